@@ -0,0 +1,286 @@
+"""Load benchmark for the API against a local MongoDB or an in-process mock.
+
+    python benchmark.py --backend mongod --sizes 1000,10000 --output bench.json
+    python benchmark.py --backend mock --sizes 1000 --compare bench.json
+
+Seeds a scratch database with synthetic foods, drinks and users, boots
+main.app in-process, drives every route with a concurrent async load
+generator and writes per-route throughput and latency percentiles as JSON.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+from contextlib import AsyncExitStack
+from datetime import datetime, timedelta
+from time import perf_counter
+
+REGIONS = ["Amhara", "Tigray", "Oromia", "Sidama", "Gurage", "Harari", "Afar", "Somali", "Gambela", "Benishangul"]
+SPICE = ["mild", "medium", "hot"]
+INGREDIENTS = ["berbere", "niter kibbeh", "teff", "chickpea", "lentil", "chicken", "beef", "onion", "garlic",
+               "ginger", "egg", "cabbage", "collard greens", "honey", "barley", "coffee", "mitmita", "tomato"]
+SYLLABLES = ["do", "ro", "wa", "ti", "shi", "ki", "fo", "ge", "nfo", "ti", "bs", "ay", "ne", "tu", "ra", "ka"]
+AMHARIC = ["ዶሮ", "ወጥ", "ሽሮ", "ክትፎ", "ጥብስ", "ጠጅ", "ቡና", "ገንፎ", "ቅቅል", "ፍርፍር"]
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", choices=["mongod", "mock"], default="mongod")
+    parser.add_argument("--mongodb-url", default=os.getenv("BENCH_MONGODB_URL", "mongodb://localhost:27017"))
+    parser.add_argument("--db-name", default="injera_benchmark")
+    parser.add_argument("--sizes", default="1000,10000", help="comma-separated food catalog sizes")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--tried-per-user", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=500, help="requests per route")
+    parser.add_argument("--routes", default="", help="comma-separated route names to run (default: all)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default="bench_output.json")
+    parser.add_argument("--compare", help="earlier output to compare against")
+    return parser.parse_args()
+
+def configure_environment(args):
+    # Must run before anything imports database.
+    os.environ["MONGODB_URL"] = args.mongodb_url
+    os.environ["MONGODB_DB_NAME"] = args.db_name
+    os.environ.setdefault("SECRET_KEY", "benchmark-secret")
+    if args.backend == "mock":
+        os.environ.setdefault("NEARBY_BACKEND", "memory")
+        from mongomock_motor import AsyncMongoMockClient
+        import database
+        database.client = AsyncMongoMockClient()
+        database.db = database.client[args.db_name]
+        database.food_collection = database.db["foods"]
+        database.drink_collection = database.db["drinks"]
+        database.user_collection = database.db["users"]
+        database.rating_collection = database.db["ratings"]
+        database.counter_collection = database.db["counters"]
+        database.change_collection = database.db["catalog_changes"]
+
+def synthetic_name(rng: random.Random, index: int) -> str:
+    return "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))).capitalize() + f" {index}"
+
+def rating_fields(rng: random.Random) -> dict:
+    hist = {str(score): rng.randint(0, 20) for score in range(1, 6)}
+    count = sum(hist.values())
+    total = sum(int(score) * n for score, n in hist.items())
+    return {"rating_count": count, "rating_sum": total, "rating_hist": hist, "rating_avg": total / count if count else None}
+
+async def seed(args, size: int, rng: random.Random) -> dict:
+    import database
+    from geo import restaurant_locations
+    from passwords import hash_password
+    from routers.users import SECRET_KEY, ALGORITHM
+    from jose import jwt
+
+    for name in ("foods", "drinks", "users", "ratings", "counters", "catalog_changes"):
+        await database.db[name].drop()
+    created_at = datetime.utcnow()
+    foods = []
+    for index in range(size):
+        restaurants = [
+            f"Restaurant {index}-{n}, Addis Ababa, {9.0 + rng.uniform(-0.3, 0.3):.5f}, {38.75 + rng.uniform(-0.3, 0.3):.5f}"
+            for n in range(rng.randint(0, 3))
+        ]
+        foods.append({
+            "name": synthetic_name(rng, index),
+            "type": "food",
+            "region": rng.choice(REGIONS),
+            "spicy_level": rng.choice(SPICE),
+            "description": " ".join(rng.sample(INGREDIENTS, 5)),
+            "ingredients": rng.sample(INGREDIENTS, rng.randint(2, 6)),
+            "photo_urls": [f"https://example.com/{index}.jpg"],
+            "restaurant_suggestions": restaurants,
+            "restaurant_locations": restaurant_locations(restaurants),
+            "vegetarian": rng.random() < 0.4,
+            "name_amharic": " ".join(rng.sample(AMHARIC, 2)),
+            "tried_count": 0,
+            "favorite_count": 0,
+            "created_at": created_at,
+            **rating_fields(rng),
+        })
+    drinks = [{
+        "name": synthetic_name(rng, index),
+        "type": "drink",
+        "region": rng.choice(REGIONS),
+        "description": "traditional drink",
+        "name_amharic": rng.choice(AMHARIC),
+        "tried_count": 0,
+        "favorite_count": 0,
+        "created_at": created_at,
+        **rating_fields(rng),
+    } for index in range(max(1, size // 5))]
+    food_ids = (await database.food_collection.insert_many(foods)).inserted_ids
+    drink_ids = (await database.drink_collection.insert_many(drinks)).inserted_ids
+    item_ids = food_ids + drink_ids
+
+    password = await hash_password("benchmark")
+    users = [{
+        "username": f"user{index}",
+        "email": f"user{index}@example.com",
+        "password": password,
+        "favorites": rng.sample(item_ids, min(len(item_ids), args.tried_per_user // 4)),
+        "tried_items": rng.sample(item_ids, min(len(item_ids), args.tried_per_user)),
+        "created_at": created_at,
+    } for index in range(args.users)]
+    user_ids = (await database.user_collection.insert_many(users)).inserted_ids
+
+    import maintenance
+    await maintenance.reconcile_counters()
+    expires = datetime.utcnow() + timedelta(hours=6)
+    tokens = [jwt.encode({"sub": str(user_id), "exp": expires}, SECRET_KEY, ALGORITHM) for user_id in user_ids]
+    return {
+        "food_ids": [str(item_id) for item_id in food_ids],
+        "drink_ids": [str(item_id) for item_id in drink_ids],
+        "tokens": tokens,
+        "emails": [user["email"] for user in users],
+    }
+
+def routes(data: dict, rng: random.Random) -> dict:
+    def food():
+        return rng.choice(data["food_ids"])
+
+    def drink():
+        return rng.choice(data["drink_ids"])
+
+    def auth():
+        return {"Authorization": f"Bearer {rng.choice(data['tokens'])}"}
+
+    # name -> () -> (method, path, params, headers, body)
+    return {
+        "GET /foods": lambda: ("GET", "/foods/", {"limit": 100}, {}, None),
+        "GET /foods?vegetarian": lambda: ("GET", "/foods/", {"vegetarian": "true", "spicy_level": rng.choice(SPICE)}, {}, None),
+        "GET /foods/{id}": lambda: ("GET", f"/foods/{food()}", {}, {}, None),
+        "GET /foods/{id}/share": lambda: ("GET", f"/foods/{food()}/share", {"lang": "am"}, {}, None),
+        "GET /foods/popular": lambda: ("GET", "/foods/popular", {}, {}, None),
+        "GET /foods/top-rated": lambda: ("GET", "/foods/top-rated", {}, {}, None),
+        "GET /foods/random": lambda: ("GET", "/foods/random", {}, {}, None),
+        "GET /foods/quiz": lambda: ("GET", "/foods/quiz", {"count": 5}, {}, None),
+        "GET /drinks": lambda: ("GET", "/drinks/", {"limit": 100}, {}, None),
+        "GET /drinks/{id}": lambda: ("GET", f"/drinks/{drink()}", {}, {}, None),
+        "GET /drinks/popular": lambda: ("GET", "/drinks/popular", {}, {}, None),
+        "GET /recommendation/random": lambda: ("GET", "/recommendation/random", {}, {}, None),
+        "GET /recommendation/by-region": lambda: ("GET", f"/recommendation/by-region/{rng.choice(REGIONS)}", {}, {}, None),
+        "GET /recommendation/daily": lambda: ("GET", "/recommendation/daily", {}, {}, None),
+        "GET /recommendation/for-me": lambda: ("GET", "/recommendation/for-me", {}, auth(), None),
+        "GET /recommendation/nearby": lambda: ("GET", "/recommendation/nearby", {"lat": 9.0 + rng.uniform(-0.2, 0.2), "lon": 38.75 + rng.uniform(-0.2, 0.2)}, {}, None),
+        "GET /search": lambda: ("GET", "/search", {"q": rng.choice(SYLLABLES + INGREDIENTS + AMHARIC)}, {}, None),
+        "GET /favorites": lambda: ("GET", "/favorites", {}, auth(), None),
+        "GET /tried": lambda: ("GET", "/tried", {"limit": 200}, auth(), None),
+        "GET /users/me": lambda: ("GET", "/users/me", {}, auth(), None),
+        "POST /tried/{id}": lambda: ("POST", f"/tried/{food()}", {}, auth(), None),
+        "POST /foods/{id}/rate": lambda: ("POST", f"/foods/{food()}/rate", {}, auth(), {"score": rng.randint(1, 5)}),
+        "POST /users/login": lambda: ("POST", "/users/login", {}, {}, {"form": {"username": rng.choice(data["emails"]), "password": "benchmark"}}),
+    }
+
+def percentile(values: list, pct: float) -> float:
+    index = (len(values) - 1) * pct / 100
+    lower = int(index)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (index - lower)
+
+async def drive(client, make_request, total: int, concurrency: int) -> dict:
+    latencies, statuses = [], {}
+    remaining = iter(range(total))
+
+    async def worker():
+        for _ in remaining:
+            method, path, params, headers, body = make_request()
+            kwargs = {"params": params, "headers": headers}
+            if body and "form" in body:
+                kwargs["data"] = body["form"]
+            elif body:
+                kwargs["json"] = body
+            started = perf_counter()
+            response = await client.request(method, path, **kwargs)
+            latencies.append((perf_counter() - started) * 1000)
+            statuses[str(response.status_code)] = statuses.get(str(response.status_code), 0) + 1
+
+    started = perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = perf_counter() - started
+    latencies.sort()
+    return {
+        "requests": total,
+        "throughput_rps": round(total / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p95_ms": round(percentile(latencies, 95), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+        "max_ms": round(latencies[-1], 3),
+        "status_codes": statuses,
+    }
+
+async def run(args) -> dict:
+    import httpx
+    from main import app
+
+    rng = random.Random(args.seed)
+    selected = {name.strip() for name in args.routes.split(",") if name.strip()}
+    results = {}
+    for size in [int(size) for size in args.sizes.split(",")]:
+        print(f"Seeding {size} foods, {args.users} users...", file=sys.stderr)
+        data = await seed(args, size, rng)
+        results[str(size)] = {}
+        async with AsyncExitStack() as stack:
+            await stack.enter_async_context(app.router.lifespan_context(app))
+            transport = httpx.ASGITransport(app=app)
+            client = await stack.enter_async_context(httpx.AsyncClient(transport=transport, base_url="http://benchmark"))
+            for name, make_request in routes(data, rng).items():
+                if selected and name not in selected:
+                    continue
+                total = max(args.concurrency, args.requests // 10) if name == "POST /users/login" else args.requests
+                result = await drive(client, make_request, total, args.concurrency)
+                results[str(size)][name] = result
+                print(f"{size:>7} {name:<32} {result['throughput_rps']:>9} rps  p50 {result['p50_ms']:>8} ms  "
+                      f"p95 {result['p95_ms']:>8} ms  p99 {result['p99_ms']:>8} ms", file=sys.stderr)
+    return results
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def compare(current: dict, baseline: dict):
+    print(f"{'size':>7} {'route':<32} {'rps':>16} {'p95 ms':>20}")
+    for size, routes_ in current["results"].items():
+        for name, result in routes_.items():
+            before = baseline.get("results", {}).get(size, {}).get(name)
+            if not before:
+                continue
+            rps_change = (result["throughput_rps"] / before["throughput_rps"] - 1) * 100 if before["throughput_rps"] else 0
+            p95_change = (result["p95_ms"] / before["p95_ms"] - 1) * 100 if before["p95_ms"] else 0
+            print(f"{size:>7} {name:<32} {result['throughput_rps']:>8} ({rps_change:+6.1f}%) "
+                  f"{result['p95_ms']:>10} ({p95_change:+6.1f}%)")
+
+def main():
+    args = parse_args()
+    configure_environment(args)
+    results = asyncio.run(run(args))
+    output = {
+        "meta": {
+            "revision": git_revision(),
+            "timestamp": datetime.utcnow().isoformat(),
+            "backend": args.backend,
+            "python": platform.python_version(),
+            "users": args.users,
+            "tried_per_user": args.tried_per_user,
+            "concurrency": args.concurrency,
+            "requests_per_route": args.requests,
+            "seed": args.seed,
+            "catalog_cache": os.getenv("CATALOG_CACHE", "0"),
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as file:
+        json.dump(output, file, indent=2)
+    print(f"Wrote {args.output}", file=sys.stderr)
+    if args.compare:
+        with open(args.compare) as file:
+            compare(output, json.load(file))
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
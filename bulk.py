@@ -0,0 +1,76 @@
+from pydantic import ValidationError
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from fastapi import Request
+import json
+
+BULK_BATCH_SIZE = 500
+MAX_REPORTED_ERRORS = 100
+
+async def ndjson_lines(request: Request):
+    buffer = b""
+    async for chunk in request.stream():
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield line
+    if buffer:
+        yield buffer
+
+async def import_ndjson(request: Request, model, collection, prepare=None) -> dict:
+    report = {"received": 0, "inserted": 0, "updated": 0, "failed": 0, "errors": []}
+    # Keyed on name so a repeated name within one batch keeps the last line.
+    batch = {}
+
+    def fail(line_number: int, error: str):
+        # Every failure is counted, but only the first few are listed.
+        report["failed"] += 1
+        if len(report["errors"]) < MAX_REPORTED_ERRORS:
+            report["errors"].append({"line": line_number, "error": error})
+
+    async def flush():
+        if not batch:
+            return
+        line_numbers = [line_number for line_number, _ in batch.values()]
+        operations = [operation for _, operation in batch.values()]
+        batch.clear()
+        try:
+            result = await collection.bulk_write(operations, ordered=False)
+            report["inserted"] += result.upserted_count
+            report["updated"] += result.matched_count
+        except BulkWriteError as error:
+            report["inserted"] += error.details.get("nUpserted", 0)
+            report["updated"] += error.details.get("nMatched", 0)
+            for write_error in error.details.get("writeErrors", []):
+                fail(line_numbers[write_error["index"]], write_error["errmsg"])
+
+    line_number = 0
+    async for line in ndjson_lines(request):
+        line_number += 1
+        if not line.strip():
+            continue
+        report["received"] += 1
+        try:
+            data = json.loads(line)
+            if not isinstance(data, dict):
+                raise ValueError("Expected a JSON object")
+            # Exports write null for items stored without a creation time.
+            if data.get("created_at") is None:
+                data.pop("created_at", None)
+            item = model(**data)
+        except (ValueError, ValidationError) as error:
+            fail(line_number, str(error))
+            continue
+        doc = item.dict()
+        created_at = doc.pop("created_at")
+        if prepare:
+            prepare(doc)
+        batch[doc["name"]] = (line_number, UpdateOne(
+            {"name": doc["name"]},
+            {"$set": doc, "$setOnInsert": {"created_at": created_at, "tried_count": 0, "favorite_count": 0}},
+            upsert=True
+        ))
+        if len(batch) >= BULK_BATCH_SIZE:
+            await flush()
+    await flush()
+    return report
\ No newline at end of file
@@ -0,0 +1,107 @@
+from collections import OrderedDict
+from time import monotonic
+from typing import Optional
+import asyncio
+
+_MISSING = object()
+
+class TTLCache:
+    def __init__(self, maxsize: int = 1024, ttl: float = 60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        entry = self.data.get(key, _MISSING)
+        if entry is _MISSING:
+            self.misses += 1
+            return default
+        value, expires_at = entry
+        if expires_at <= monotonic():
+            del self.data[key]
+            self.misses += 1
+            return default
+        self.data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value, ttl: Optional[float] = None):
+        self.data[key] = (value, monotonic() + (self.ttl if ttl is None else ttl))
+        self.data.move_to_end(key)
+        while len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key):
+        self.data.pop(key, None)
+
+    def clear(self):
+        self.data.clear()
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self.data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+class SingleFlight:
+    # Concurrent identical lookups share one call. Nothing is kept once the call
+    # completes, so the next request after that always starts a fresh one.
+    def __init__(self, max_tracked_keys: int = 1024):
+        self.calls = {}
+        self.key_stats = OrderedDict()
+        self.max_tracked_keys = max_tracked_keys
+        self.leaders = 0
+        self.shared = 0
+
+    def _count(self, key, index: int):
+        counts = self.key_stats.get(key)
+        if counts is None:
+            counts = self.key_stats[key] = [0, 0]
+            if len(self.key_stats) > self.max_tracked_keys:
+                self.key_stats.popitem(last=False)
+        else:
+            self.key_stats.move_to_end(key)
+        counts[index] += 1
+
+    def _finished(self, key, task: asyncio.Task):
+        if self.calls.get(key) is task:
+            del self.calls[key]
+        if not task.cancelled():
+            # Mark the exception retrieved; every waiter already got it.
+            task.exception()
+
+    async def do(self, key, call):
+        task = self.calls.get(key)
+        if task is None:
+            self.leaders += 1
+            self._count(key, 0)
+            # A separate task, so a disconnecting client can't cancel it for the others.
+            task = self.calls[key] = asyncio.ensure_future(call())
+            task.add_done_callback(lambda done: self._finished(key, done))
+        else:
+            self.shared += 1
+            self._count(key, 1)
+        return await asyncio.shield(task)
+
+    def forget(self, *args):
+        # Catalog listener: after a write, new requests must not join a call
+        # that may have read the old document.
+        self.calls.clear()
+
+    def stats(self, top: int = 10) -> dict:
+        busiest = sorted(self.key_stats.items(), key=lambda entry: entry[1][1], reverse=True)[:top]
+        return {
+            "in_flight": len(self.calls),
+            "calls": self.leaders,
+            "shared": self.shared,
+            "keys": [{"key": " ".join(map(str, key)), "calls": calls, "shared": shared} for key, (calls, shared) in busiest],
+        }
+
+single_flight = SingleFlight()
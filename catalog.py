@@ -0,0 +1,403 @@
+from bisect import bisect_right
+from collections import defaultdict
+from time import monotonic
+from typing import Optional
+from bson import ObjectId
+from fastapi import HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+CATALOG_CACHE = os.getenv("CATALOG_CACHE", "0") == "1"
+CATALOG_CHANGE_STREAMS = os.getenv("CATALOG_CHANGE_STREAMS", "0") == "1"
+CHANGE_STREAM_RETRY_SECONDS = 5
+# Other workers' writes only bump our versions with change streams on.
+FACETS_TTL_SECONDS = float(os.getenv("REGION_FACETS_TTL_SECONDS", "60"))
+MAX_RENDERED_RESPONSES = 256
+DEFAULT_PAGE_SIZE = 100
+SUMMARY_EXCLUDED_FIELDS = ("rating_hist", "ingredients")
+
+logger = logging.getLogger(__name__)
+
+caches = []
+
+def localize(serialized: dict, lang: str) -> dict:
+    if lang == "am" and serialized.get("name_amharic"):
+        return {**serialized, "name": serialized["name_amharic"]}
+    return serialized
+
+def dump_json(value) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode()
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    return header.strip() == "*" or etag in [tag.strip() for tag in header.split(",")]
+
+def cached_json_response(request: Request, etag: str, body: bytes, headers: Optional[dict] = None) -> Response:
+    headers = {**(headers or {}), "ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+def pick(serialized: dict, fields: tuple) -> dict:
+    return {field: serialized.get(field) for field in fields}
+
+class CatalogCache:
+    def __init__(self, name: str, collection, serializer, index_fields=("region",)):
+        self.name = name
+        self.collection = collection
+        self.serializer = serializer
+        self.fields = tuple(serializer({"_id": "", "name": ""}))
+        self.enabled = CATALOG_CACHE
+        self.items = {}
+        self.indexes = {field: defaultdict(set) for field in index_fields}
+        self.loaded = False
+        # Writes seen while a load is scanning, replayed over the fresh maps.
+        self.reloading = None
+        self.load_lock = asyncio.Lock()
+        self.version = 0
+        # Only bumped when items come or go, not on every counter or rating write.
+        self.membership_version = 0
+        self.rendered = {}
+        self.rendered_version = 0
+        self.listeners = []
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        caches.append(self)
+
+    @property
+    def ready(self) -> bool:
+        return self.enabled and self.loaded
+
+    async def load(self):
+        if not self.enabled:
+            return
+        async with self.load_lock:
+            self.reloading = {}
+            try:
+                fresh = [self.serializer(doc) async for doc in self.collection.find().sort("_id", 1)]
+                self._replace(fresh)
+                for item_id, serialized in self.reloading.items():
+                    if serialized is None:
+                        self._drop(item_id)
+                    else:
+                        self._index(serialized)
+            finally:
+                self.reloading = None
+            self.loaded = True
+            self.version += 1
+            self.membership_version += 1
+
+    def load_items(self, serialized_items):
+        # Fill the cache from already serialized items, e.g. a snapshot file.
+        self._replace(serialized_items)
+        self.loaded = True
+        self.version += 1
+        self.membership_version += 1
+
+    def _replace(self, serialized_items):
+        # Build the new maps aside and swap them in at once, so requests served
+        # during a reload see the old catalog rather than a partial one.
+        items = {serialized["id"]: serialized for serialized in serialized_items}
+        indexes = {field: defaultdict(set) for field in self.indexes}
+        for item_id, serialized in items.items():
+            for field, index in indexes.items():
+                index[serialized.get(field)].add(item_id)
+        self.items, self.indexes = items, indexes
+
+    def _store(self, doc) -> dict:
+        return self._index(self.serializer(doc))
+
+    def _index(self, serialized: dict) -> dict:
+        self._drop(serialized["id"])
+        self.items[serialized["id"]] = serialized
+        for field, index in self.indexes.items():
+            index[serialized.get(field)].add(serialized["id"])
+        return serialized
+
+    def _drop(self, item_id: str) -> bool:
+        serialized = self.items.pop(item_id, None)
+        if serialized is None:
+            return False
+        for field, index in self.indexes.items():
+            ids = index.get(serialized.get(field))
+            if ids is not None:
+                ids.discard(item_id)
+                if not ids:
+                    del index[serialized.get(field)]
+        return True
+
+    def _notify(self, item_id: Optional[str], serialized: Optional[dict]):
+        # serialized is None for a removal; item_id is None when everything may have changed.
+        for listener in self.listeners:
+            listener(self, item_id, serialized)
+
+    def put(self, doc, created: bool = False):
+        self.version += 1
+        if created or (self.ready and str(doc["_id"]) not in self.items):
+            self.membership_version += 1
+        serialized = self._store(doc) if self.ready else self.serializer(doc)
+        if self.reloading is not None:
+            self.reloading[serialized["id"]] = serialized
+        self._notify(serialized["id"], serialized)
+
+    async def reload(self):
+        self.version += 1
+        self.membership_version += 1
+        if self.ready:
+            await self.load()
+        self._notify(None, None)
+
+    async def refresh(self, item_id: str):
+        self.version += 1
+        if self.ready or self.listeners:
+            doc = await self.collection.find_one({"_id": ObjectId(item_id)})
+            if doc:
+                self.put(doc)
+            else:
+                self.evict(item_id)
+
+    def evict(self, item_id: str):
+        self.version += 1
+        self.membership_version += 1
+        if self.ready and self._drop(item_id):
+            self.evictions += 1
+        if self.reloading is not None:
+            self.reloading[item_id] = None
+        self._notify(item_id, None)
+
+    async def get(self, item_id: str):
+        if self.ready:
+            if item_id in self.items:
+                self.hits += 1
+                return self.items[item_id]
+            self.misses += 1
+        doc = await self.collection.find_one({"_id": ObjectId(item_id)})
+        if not doc:
+            return None
+        # May have been written by another worker since we loaded.
+        return self._store(doc) if self.ready else self.serializer(doc)
+
+    async def get_many(self, item_ids: list) -> dict:
+        found = {}
+        if self.ready:
+            for item_id in item_ids:
+                if item_id in self.items:
+                    found[item_id] = self.items[item_id]
+            self.hits += len(found)
+            self.misses += len(item_ids) - len(found)
+        missing = [ObjectId(item_id) for item_id in item_ids if item_id not in found]
+        if missing:
+            async for doc in self.collection.find({"_id": {"$in": missing}}):
+                serialized = self._store(doc) if self.ready else self.serializer(doc)
+                found[serialized["id"]] = serialized
+        return found
+
+    def select_fields(self, fields: Optional[str], view: str) -> tuple:
+        if fields:
+            selected = {field.strip() for field in fields.split(",") if field.strip()}
+            unknown = selected - set(self.fields)
+            if unknown:
+                raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+            return tuple(field for field in self.fields if field in selected or field == "id")
+        if view == "full":
+            return self.fields
+        return tuple(field for field in self.fields if field not in SUMMARY_EXCLUDED_FIELDS)
+
+    def _query(self, filters: dict, after: Optional[str], fields: Optional[tuple]):
+        query = dict(filters)
+        if after:
+            query["_id"] = {"$gt": ObjectId(after)}
+        projection = None
+        if fields:
+            # The serializer always needs the name, and localize needs the Amharic one.
+            projection = {field: 1 for field in fields if field != "id"}
+            projection.update(name=1, name_amharic=1)
+        return self.collection.find(query, projection).sort("_id", 1)
+
+    async def find(self, limit: Optional[int] = None, after: Optional[str] = None, fields: Optional[tuple] = None, **filters) -> list:
+        filters = {field: value for field, value in filters.items() if value is not None}
+        if not self.ready:
+            cursor = self._query(filters, after, fields)
+            if limit:
+                cursor = cursor.limit(limit)
+            return [self.serializer(doc) async for doc in cursor]
+        self.hits += 1
+        if not filters and not after and not limit:
+            return list(self.items.values())
+        ids = None
+        for field, value in filters.items():
+            matched = self.indexes[field].get(value, set())
+            ids = matched if ids is None else ids & matched
+        ids = sorted(self.items if ids is None else ids)
+        if after:
+            ids = ids[bisect_right(ids, after):]
+        if limit:
+            ids = ids[:limit]
+        return [self.items[item_id] for item_id in ids]
+
+    async def list_response(self, request: Request, filters: dict, limit: Optional[int], after: Optional[str],
+                            fields: Optional[str], view: str, lang: str, format: str) -> Response:
+        selected = self.select_fields(fields, view)
+        if after and not ObjectId.is_valid(after):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        if format == "ndjson":
+            return StreamingResponse(self.stream(filters, after, selected, lang), media_type="application/x-ndjson")
+        limit = limit or DEFAULT_PAGE_SIZE
+
+        async def build():
+            items = await self.find(limit=limit + 1, after=after, fields=selected, **filters)
+            headers = {"X-Next-Cursor": items[limit - 1]["id"]} if len(items) > limit else {}
+            return [pick(localize(item, lang), selected) for item in items[:limit]], headers
+
+        key = (tuple(sorted(filters.items(), key=lambda item: item[0])), limit, after, selected, lang)
+        etag, body, headers = await self.render(key, build)
+        return cached_json_response(request, etag, body, headers)
+
+    async def stream(self, filters: dict, after: Optional[str], fields: tuple, lang: str):
+        filters = {field: value for field, value in filters.items() if value is not None}
+        async for doc in self._query(filters, after, fields):
+            yield dump_json(pick(localize(self.serializer(doc), lang), fields)) + b"\n"
+
+    async def render(self, key, build):
+        if self.rendered_version != self.version or len(self.rendered) >= MAX_RENDERED_RESPONSES:
+            self.rendered.clear()
+            self.rendered_version = self.version
+        if self.ready and key in self.rendered:
+            return self.rendered[key]
+        payload, headers = await build()
+        body = dump_json(payload)
+        # Hash the bytes rather than exposing the per-process version so
+        # every worker hands out the same tag for the same catalog.
+        etag = f'"{hashlib.blake2b(body, digest_size=12).hexdigest()}"'
+        if self.ready:
+            self.rendered[key] = (etag, body, headers)
+        return etag, body, headers
+
+    async def watch(self):
+        resync = False
+        while True:
+            try:
+                if resync:
+                    # Catch up on whatever the broken stream missed.
+                    await self.reload()
+                    resync = False
+                async with self.collection.watch(full_document="updateLookup") as stream:
+                    async for change in stream:
+                        item_id = str(change["documentKey"]["_id"])
+                        if change["operationType"] == "delete":
+                            self.evict(item_id)
+                        elif change.get("fullDocument"):
+                            self.put(change["fullDocument"])
+                        else:
+                            await self.refresh(item_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("%s change stream failed, reloading cache", self.name)
+                resync = True
+                await asyncio.sleep(CHANGE_STREAM_RETRY_SECONDS)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "loaded": self.loaded,
+            "size": len(self.items),
+            "version": self.version,
+            "membership_version": self.membership_version,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "rendered_responses": len(self.rendered),
+        }
+
+async def start_catalog_caches() -> list:
+    for cache in caches:
+        if not cache.loaded:
+            await cache.load()
+    if not (CATALOG_CACHE and CATALOG_CHANGE_STREAMS):
+        return []
+    return [asyncio.create_task(cache.watch()) for cache in caches]
+
+def catalog_stats() -> dict:
+    return {cache.name: cache.stats() for cache in caches}
+
+async def locate(item_id: str) -> Optional[CatalogCache]:
+    # Which catalog an id belongs to, probing every collection in one round trip.
+    for cache in caches:
+        if cache.ready and item_id in cache.items:
+            return cache
+    item_oid = ObjectId(item_id)
+    found = await asyncio.gather(*(cache.collection.find_one({"_id": item_oid}, {"_id": 1}) for cache in caches))
+    return next((cache for cache, doc in zip(caches, found) if doc), None)
+
+async def get_items(item_ids: list) -> list:
+    found = {}
+    for cache in caches:
+        if cache.ready:
+            found.update((item_id, cache.items[item_id]) for item_id in item_ids if item_id in cache.items)
+    missing = [item_id for item_id in item_ids if item_id not in found]
+    if missing:
+        for items in await asyncio.gather(*(cache.get_many(missing) for cache in caches)):
+            found.update(items)
+    return [found[item_id] for item_id in item_ids if item_id in found]
+
+class RegionFacets:
+    def __init__(self):
+        self.facets = []
+        self.versions = None
+        self.loaded_at = 0.0
+        self.lock = asyncio.Lock()
+        self.hits = 0
+        self.refreshes = 0
+
+    def stale(self) -> bool:
+        # Counts only move when items come or go; edits to region or the
+        # vegetarian flag show up once the TTL expires.
+        return self.versions != tuple(cache.membership_version for cache in caches) or monotonic() - self.loaded_at > FACETS_TTL_SECONDS
+
+    def pipeline(self) -> list:
+        first, *rest = caches
+        pipeline = [{"$project": {"region": 1, "vegetarian": 1, "kind": {"$literal": first.name}}}]
+        for cache in rest:
+            pipeline.append({"$unionWith": {
+                "coll": cache.collection.name,
+                "pipeline": [{"$project": {"region": 1, "vegetarian": 1, "kind": {"$literal": cache.name}}}],
+            }})
+        counts = {cache.name: {"$sum": {"$cond": [{"$eq": ["$kind", cache.name]}, 1, 0]}} for cache in caches}
+        pipeline += [
+            {"$group": {"_id": "$region", **counts, "vegetarian": {"$sum": {"$cond": [{"$eq": ["$vegetarian", True]}, 1, 0]}}}},
+            {"$sort": {"_id": 1}},
+        ]
+        return pipeline
+
+    async def get(self) -> list:
+        if self.stale():
+            async with self.lock:
+                if self.stale():
+                    versions = tuple(cache.membership_version for cache in caches)
+                    rows = await caches[0].collection.aggregate(self.pipeline()).to_list(None)
+                    self.facets = [{"region": row.pop("_id"), **row} for row in rows]
+                    self.versions, self.loaded_at = versions, monotonic()
+                    self.refreshes += 1
+                    return self.facets
+        self.hits += 1
+        return self.facets
+
+    def stats(self) -> dict:
+        return {"regions": len(self.facets), "hits": self.hits, "refreshes": self.refreshes}
+
+region_facets = RegionFacets()
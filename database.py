@@ -1,12 +1,266 @@
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import GEOSPHERE, ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
+from pymongo.monitoring import CommandListener, ConnectionPoolListener
+from bson import ObjectId
 from dotenv import load_dotenv
+from collections import defaultdict
+from contextvars import ContextVar
+from threading import Lock, local
+from time import monotonic
+import asyncio
+import logging
 import os
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 MONGODB_URL = os.getenv("MONGODB_URL")
-client = AsyncIOMotorClient(MONGODB_URL)
-db = client["ethiopian_food_db"]
+MONGODB_DB_NAME = os.getenv("MONGODB_DB_NAME", "ethiopian_food_db")
+EXPLAIN_QUERIES = os.getenv("EXPLAIN_QUERIES", "0") == "1"
+MAX_POOL_SIZE = int(os.getenv("MONGODB_MAX_POOL_SIZE", "100"))
+MIN_POOL_SIZE = int(os.getenv("MONGODB_MIN_POOL_SIZE", "5"))
+PING_TIMEOUT_SECONDS = float(os.getenv("MONGODB_PING_TIMEOUT_SECONDS", "2"))
+
+class PoolMonitor(ConnectionPoolListener):
+    def __init__(self):
+        self.lock = Lock()
+        self.local = local()
+        self.open = 0
+        self.in_use = 0
+        self.checkouts = 0
+        self.failed_checkouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        with self.lock:
+            self.open += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        with self.lock:
+            self.open -= 1
+
+    def connection_check_out_started(self, event):
+        # Checkout start and finish are reported on the same thread.
+        self.local.started = monotonic()
+
+    def connection_check_out_failed(self, event):
+        with self.lock:
+            self.failed_checkouts += 1
+
+    def connection_checked_out(self, event):
+        wait = monotonic() - getattr(self.local, "started", monotonic())
+        with self.lock:
+            self.in_use += 1
+            self.checkouts += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+
+    def connection_checked_in(self, event):
+        with self.lock:
+            self.in_use -= 1
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "max_pool_size": MAX_POOL_SIZE,
+                "min_pool_size": MIN_POOL_SIZE,
+                "open_connections": self.open,
+                "in_use_connections": self.in_use,
+                "checkouts": self.checkouts,
+                "failed_checkouts": self.failed_checkouts,
+                "avg_checkout_wait_ms": round(1000 * self.total_wait / self.checkouts, 3) if self.checkouts else 0.0,
+                "max_checkout_wait_ms": round(1000 * self.max_wait, 3),
+            }
+
+pool_monitor = PoolMonitor()
+
+class RequestTrace:
+    __slots__ = ("method", "route", "commands")
+
+    def __init__(self, method: str, route: str):
+        self.method = method
+        self.route = route
+        self.commands = []
+
+# Motor runs pymongo on an executor with a copy of the caller's context,
+# so listeners see the trace of the request that issued the command.
+current_trace = ContextVar("current_trace", default=None)
+
+class CommandTracer(CommandListener):
+    def __init__(self):
+        self.lock = Lock()
+        self.pending = {}
+        # (method, route, command, collection) -> [count, failures, seconds, documents]
+        self.totals = defaultdict(lambda: [0, 0, 0.0, 0])
+
+    def started(self, event):
+        target = event.command.get("collection" if event.command_name == "getMore" else event.command_name)
+        self.pending[(event.connection_id, event.request_id)] = (
+            current_trace.get(), target if isinstance(target, str) else "",
+        )
+
+    def _finish(self, event, documents: int, failed: bool):
+        trace, collection = self.pending.pop((event.connection_id, event.request_id), (None, ""))
+        seconds = event.duration_micros / 1e6
+        if trace is not None:
+            trace.commands.append((event.command_name, collection, round(seconds * 1000, 3), documents, not failed))
+        with self.lock:
+            route = (trace.method, trace.route) if trace else ("", "background")
+            totals = self.totals[route + (event.command_name, collection)]
+            totals[0] += 1
+            totals[1] += failed
+            totals[2] += seconds
+            totals[3] += documents
+
+    def succeeded(self, event):
+        reply = event.reply
+        cursor = reply.get("cursor")
+        if cursor:
+            documents = len(cursor.get("firstBatch", cursor.get("nextBatch", ())))
+        else:
+            documents = 1 if reply.get("value") else 0
+        self._finish(event, documents, False)
+
+    def failed(self, event):
+        self._finish(event, 0, True)
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {key: list(values) for key, values in self.totals.items()}
+
+command_tracer = CommandTracer()
+
+# connect=False: nothing touches the network until the lifespan handler
+# calls connect(), but routers can still import collections at load time.
+client = AsyncIOMotorClient(
+    MONGODB_URL,
+    connect=False,
+    maxPoolSize=MAX_POOL_SIZE,
+    minPoolSize=MIN_POOL_SIZE,
+    maxIdleTimeMS=int(os.getenv("MONGODB_MAX_IDLE_TIME_MS", "300000")),
+    waitQueueTimeoutMS=int(os.getenv("MONGODB_WAIT_QUEUE_TIMEOUT_MS", "2000")),
+    connectTimeoutMS=int(os.getenv("MONGODB_CONNECT_TIMEOUT_MS", "5000")),
+    serverSelectionTimeoutMS=int(os.getenv("MONGODB_SERVER_SELECTION_TIMEOUT_MS", "5000")),
+    event_listeners=[pool_monitor, command_tracer],
+)
+db = client[MONGODB_DB_NAME]
 food_collection = db["foods"]
 drink_collection = db["drinks"]
-user_collection = db["users"]
\ No newline at end of file
+user_collection = db["users"]
+rating_collection = db["ratings"]
+counter_collection = db["counters"]
+change_collection = db["catalog_changes"]
+
+INDEXES = {
+    "foods": [
+        ([("restaurant_locations", GEOSPHERE)], {}),
+        ([("name", ASCENDING)], {}),
+        # List filters page by _id, so it trails the equality fields.
+        ([("region", ASCENDING), ("_id", ASCENDING)], {}),
+        ([("vegetarian", ASCENDING), ("spicy_level", ASCENDING), ("_id", ASCENDING)], {}),
+        ([("spicy_level", ASCENDING), ("_id", ASCENDING)], {}),
+        ([("tried_count", DESCENDING)], {}),
+        ([("rating_avg", DESCENDING)], {}),
+    ],
+    "drinks": [
+        ([("name", ASCENDING)], {}),
+        ([("region", ASCENDING), ("_id", ASCENDING)], {}),
+        ([("tried_count", DESCENDING)], {}),
+        ([("rating_avg", DESCENDING)], {}),
+    ],
+    "users": [
+        ([("email", ASCENDING)], {"unique": True}),
+    ],
+    "ratings": [
+        ([("item_id", ASCENDING), ("user_id", ASCENDING)], {"unique": True}),
+    ],
+    "catalog_changes": [
+        ([("version", ASCENDING)], {}),
+    ],
+}
+
+# A page after the first: list routes range and sort on _id.
+PAGE_AFTER = {"_id": {"$gt": ObjectId("000000000000000000000000")}}
+PAGE_ORDER = [("_id", ASCENDING)]
+
+# (route, collection name, filter, sort) for the queries routes issue.
+QUERY_SHAPES = [
+    ("GET /foods", "foods", PAGE_AFTER, PAGE_ORDER),
+    ("GET /foods?vegetarian", "foods", {"vegetarian": True, **PAGE_AFTER}, PAGE_ORDER),
+    ("GET /foods?spicy_level", "foods", {"spicy_level": "hot", **PAGE_AFTER}, PAGE_ORDER),
+    ("GET /foods?vegetarian&spicy_level", "foods", {"vegetarian": True, "spicy_level": "hot", **PAGE_AFTER}, PAGE_ORDER),
+    ("GET /drinks", "drinks", PAGE_AFTER, PAGE_ORDER),
+    ("GET /foods/popular", "foods", {}, [("tried_count", DESCENDING)]),
+    ("GET /foods/top-rated", "foods", {"rating_count": {"$gte": 1}}, [("rating_avg", DESCENDING)]),
+    ("GET /drinks/popular", "drinks", {}, [("tried_count", DESCENDING)]),
+    ("GET /drinks/top-rated", "drinks", {"rating_count": {"$gte": 1}}, [("rating_avg", DESCENDING)]),
+    ("GET /recommendation/by-region (foods)", "foods", {"region": "Amhara", **PAGE_AFTER}, PAGE_ORDER),
+    ("GET /recommendation/by-region (drinks)", "drinks", {"region": "Amhara", **PAGE_AFTER}, PAGE_ORDER),
+    ("GET /recommendation/nearby", "foods",
+     {"restaurant_locations": {"$nearSphere": {"$geometry": {"type": "Point", "coordinates": [38.74, 9.03]}, "$maxDistance": 10000}}}, None),
+    ("POST /foods/bulk", "foods", {"name": "Doro Wat"}, None),
+    ("POST /drinks/bulk", "drinks", {"name": "Tej"}, None),
+    ("POST /users, POST /users/login", "users", {"email": "someone@example.com"}, None),
+    ("POST /foods/{id}/rate", "ratings", {"item_id": ObjectId(), "user_id": "someone"}, None),
+]
+
+async def ping() -> float:
+    started = monotonic()
+    await asyncio.wait_for(client.admin.command("ping"), PING_TIMEOUT_SECONDS)
+    return (monotonic() - started) * 1000
+
+async def connect():
+    # Concurrent pings open up to minPoolSize connections before traffic arrives.
+    await asyncio.gather(*(ping() for _ in range(max(1, MIN_POOL_SIZE))))
+
+def close():
+    client.close()
+
+async def ensure_indexes():
+    for name, indexes in INDEXES.items():
+        for keys, options in indexes:
+            try:
+                await db[name].create_index(keys, **options)
+            except OperationFailure as error:
+                logger.error("Could not create index %s on %s: %s", keys, name, error)
+
+def _stages(plan: dict):
+    yield plan.get("stage")
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            yield from _stages(plan[key])
+    for child in plan.get("inputStages", []):
+        yield from _stages(child)
+
+async def explain_queries():
+    for route, name, query, sort in QUERY_SHAPES:
+        cursor = db[name].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        try:
+            plan = (await cursor.explain())["queryPlanner"]["winningPlan"]
+        except OperationFailure as error:
+            logger.warning("Could not explain %s: %s", route, error)
+            continue
+        if "COLLSCAN" in _stages(plan):
+            logger.warning("COLLSCAN in %s on %s for %s", route, name, query)
+        else:
+            logger.info("%s uses an index", route)
\ No newline at end of file
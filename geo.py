@@ -0,0 +1,139 @@
+from collections import defaultdict
+from math import radians, sin, cos, asin, sqrt, floor
+from time import monotonic
+from typing import Optional
+from pymongo import UpdateOne
+from database import food_collection
+import asyncio
+import os
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = 111.195
+CELL_DEGREES = 0.1
+LON_CELLS = int(360 / CELL_DEGREES)
+NEARBY_BACKEND = os.getenv("NEARBY_BACKEND", "mongo")
+BACKFILL_BATCH_SIZE = 1000
+# Foods written by other workers only reach the grid on a reload.
+NEARBY_INDEX_TTL_SECONDS = float(os.getenv("NEARBY_INDEX_TTL_SECONDS", "60"))
+
+def parse_restaurant(restaurant: str):
+    # "Name, City, Lat, Lon"
+    parts = restaurant.split(", ")
+    if len(parts) < 4:
+        return None
+    try:
+        lat, lon = float(parts[2]), float(parts[3])
+    except ValueError:
+        return None
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return None
+    return lat, lon
+
+def restaurant_locations(restaurants) -> Optional[dict]:
+    coordinates = []
+    for restaurant in restaurants or []:
+        point = parse_restaurant(restaurant)
+        if point and [point[1], point[0]] not in coordinates:
+            coordinates.append([point[1], point[0]])
+    if not coordinates:
+        return None
+    return {"type": "MultiPoint", "coordinates": coordinates}
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    dlat = radians(lat2 - lat1)
+    dlon = radians(lon2 - lon1)
+    a = sin(dlat / 2) ** 2 + cos(radians(lat1)) * cos(radians(lat2)) * sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * asin(min(1.0, sqrt(a)))
+
+def _cell(lat: float, lon: float):
+    return floor(lat / CELL_DEGREES), floor(lon / CELL_DEGREES) % LON_CELLS
+
+class GeoIndex:
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.cells = defaultdict(set)
+        self.points = {}
+        self.loaded_at = 0.0
+        self.lock = asyncio.Lock()
+        self.reloads = 0
+
+    def stale(self) -> bool:
+        return self.enabled and monotonic() - self.loaded_at > NEARBY_INDEX_TTL_SECONDS
+
+    async def load(self):
+        # Fill a fresh grid and swap it in, so lookups never see a half-built one.
+        fresh = GeoIndex()
+        async for food in food_collection.find({"restaurant_locations": {"$ne": None}}, {"restaurant_locations": 1}):
+            fresh.add(str(food["_id"]), food["restaurant_locations"])
+        self.cells, self.points, self.loaded_at = fresh.cells, fresh.points, monotonic()
+        self.reloads += 1
+
+    async def refresh(self):
+        if self.stale():
+            async with self.lock:
+                if self.stale():
+                    await self.load()
+
+    def add(self, item_id: str, locations: Optional[dict]):
+        self.remove(item_id)
+        if not (self.enabled and locations):
+            return
+        points = [(lat, lon) for lon, lat in locations["coordinates"]]
+        self.points[item_id] = points
+        for lat, lon in points:
+            self.cells[_cell(lat, lon)].add(item_id)
+
+    def remove(self, item_id: str):
+        for lat, lon in self.points.pop(item_id, []):
+            cell = _cell(lat, lon)
+            self.cells[cell].discard(item_id)
+            if not self.cells[cell]:
+                del self.cells[cell]
+
+    def _candidates(self, lat: float, lon: float, radius_km: float):
+        dlat = radius_km / KM_PER_DEGREE
+        lat_cos = cos(radians(min(89.9, abs(lat) + dlat)))
+        dlon = radius_km / (KM_PER_DEGREE * lat_cos)
+        rows = range(floor((lat - dlat) / CELL_DEGREES), floor((lat + dlat) / CELL_DEGREES) + 1)
+        first, last = floor((lon - dlon) / CELL_DEGREES), floor((lon + dlon) / CELL_DEGREES)
+        cols = range(LON_CELLS) if last - first + 1 >= LON_CELLS else [c % LON_CELLS for c in range(first, last + 1)]
+        candidates = set()
+        for row in rows:
+            for col in cols:
+                candidates |= self.cells.get((row, col), set())
+        return candidates, dlat
+
+    def nearby(self, lat: float, lon: float, radius_km: float, limit: Optional[int] = None):
+        candidates, dlat = self._candidates(lat, lon, radius_km)
+        hits = []
+        for item_id in candidates:
+            best = None
+            for point_lat, point_lon in self.points[item_id]:
+                # Cheap latitude band check before the trigonometry.
+                if abs(point_lat - lat) > dlat:
+                    continue
+                distance = haversine_km(lat, lon, point_lat, point_lon)
+                if distance <= radius_km and (best is None or distance < best):
+                    best = distance
+            if best is not None:
+                hits.append((item_id, best))
+        hits.sort(key=lambda hit: hit[1])
+        return hits[:limit] if limit else hits
+
+# Only the memory backend reads the grid, so $geoNear deployments skip building it.
+nearby_index = GeoIndex(enabled=NEARBY_BACKEND == "memory")
+
+async def sync_restaurant_locations():
+    operations = []
+    async for food in food_collection.find({"restaurant_locations": {"$exists": False}}, {"restaurant_suggestions": 1}):
+        operations.append(UpdateOne(
+            {"_id": food["_id"]},
+            {"$set": {"restaurant_locations": restaurant_locations(food.get("restaurant_suggestions"))}}
+        ))
+        if len(operations) >= BACKFILL_BATCH_SIZE:
+            await food_collection.bulk_write(operations, ordered=False)
+            operations = []
+    if operations:
+        await food_collection.bulk_write(operations, ordered=False)
+    if nearby_index.enabled:
+        await nearby_index.load()
\ No newline at end of file
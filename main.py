@@ -1,8 +1,45 @@
+from contextlib import asynccontextmanager
+import asyncio
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from routers import foods, drinks, users, recommendations, favorites
+from fastapi.responses import JSONResponse, PlainTextResponse
+from routers import foods, drinks, users, recommendations, favorites, search, sync
+from database import connect, close, ping, pool_monitor, ensure_indexes, explain_queries, EXPLAIN_QUERIES
+from geo import sync_restaurant_locations
+from catalog import start_catalog_caches, catalog_stats, region_facets
+from passwords import hash_pool
+from ratings import rating_buffer
+from cache import single_flight
+from snapshot import warm_start, snapshot_cache
+from metrics import MetricsMiddleware, metrics
+from picks import pick_stats
+from routers.users import token_cache, user_cache
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await connect()
+    await ensure_indexes()
+    if EXPLAIN_QUERIES:
+        await explain_queries()
+    await sync_restaurant_locations()
+    await warm_start()
+    background_tasks = await start_catalog_caches()
+    await search.search_index.build()
+    await recommendations.recommender.build()
+    background_tasks.append(asyncio.create_task(recommendations.recommender.run()))
+    if rating_buffer.enabled:
+        background_tasks.append(asyncio.create_task(rating_buffer.run()))
+    app.state.ready = True
+    yield
+    app.state.ready = False
+    for task in background_tasks:
+        task.cancel()
+    await rating_buffer.flush()
+    hash_pool.shutdown()
+    close()
+
+app = FastAPI(lifespan=lifespan)
+app.state.ready = False
 
 app.add_middleware(
     CORSMiddleware,
@@ -11,13 +48,56 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Added last so it wraps everything, including CORS preflights.
+app.add_middleware(MetricsMiddleware)
 
 app.include_router(foods.router)
 app.include_router(drinks.router)
 app.include_router(users.router)
 app.include_router(recommendations.router)
 app.include_router(favorites.router)
+app.include_router(search.router)
+app.include_router(sync.router)
 
 @app.get("/")
 async def root():
-    return {"message": "API running"}
\ No newline at end of file
+    return {"message": "API running"}
+
+async def database_status() -> dict:
+    try:
+        return {"ok": True, "ping_ms": round(await ping(), 3), **pool_monitor.stats()}
+    except Exception as error:
+        return {"ok": False, "error": repr(error), **pool_monitor.stats()}
+
+@app.get("/healthz")
+async def healthz():
+    return {"status": "alive", "database": await database_status()}
+
+@app.get("/readyz")
+async def readyz():
+    database = await database_status()
+    ready = app.state.ready and database["ok"]
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={"status": "ready" if ready else "not ready", "database": database},
+    )
+
+@app.get("/cache/stats")
+async def cache_stats():
+    return {
+        "catalog": catalog_stats(),
+        "tokens": token_cache.stats(),
+        "users": user_cache.stats(),
+        "pick_pools": pick_stats(),
+        "search": search.search_index.stats(),
+        "recommender": recommendations.recommender.stats(),
+        "password_hashing": hash_pool.stats(),
+        "rating_buffer": rating_buffer.stats(),
+        "single_flight": single_flight.stats(),
+        "region_facets": region_facets.stats(),
+        "snapshot": snapshot_cache.stats(),
+    }
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
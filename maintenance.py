@@ -0,0 +1,82 @@
+import asyncio
+import sys
+from collections import Counter
+from datetime import datetime
+from pymongo import UpdateOne
+from database import food_collection, drink_collection, user_collection, rating_collection
+from ratings import rating_stats, EMPTY_RATING_STATS
+
+BATCH_SIZE = 1000
+
+async def count_user_lists():
+    counts = {"tried_count": Counter(), "favorite_count": Counter()}
+    async for user in user_collection.find({}, {"tried_items": 1, "favorites": 1}):
+        counts["tried_count"].update(set(user.get("tried_items", [])))
+        counts["favorite_count"].update(set(user.get("favorites", [])))
+    return counts
+
+async def reconcile_counters():
+    counts = await count_user_lists()
+    fixed = 0
+    for collection in (food_collection, drink_collection):
+        operations = []
+        async for item in collection.find({}, {"tried_count": 1, "favorite_count": 1}):
+            expected = {field: counter.get(item["_id"], 0) for field, counter in counts.items()}
+            if any(item.get(field) != value for field, value in expected.items()):
+                operations.append(UpdateOne({"_id": item["_id"]}, {"$set": expected}))
+            if len(operations) >= BATCH_SIZE:
+                fixed += (await collection.bulk_write(operations, ordered=False)).modified_count
+                operations = []
+        if operations:
+            fixed += (await collection.bulk_write(operations, ordered=False)).modified_count
+    print(f"Reconciled popularity counters on {fixed} items")
+
+async def migrate_ratings():
+    moved = 0
+    for item_type, collection in (("food", food_collection), ("drink", drink_collection)):
+        async for item in collection.find({"ratings.0": {"$exists": True}}, {"ratings": 1}):
+            # Later entries win, matching one rating per user going forward.
+            latest = {rating["user_id"]: rating["score"] for rating in item["ratings"]}
+            operations = [
+                UpdateOne(
+                    {"item_id": item["_id"], "user_id": user_id},
+                    {"$setOnInsert": {"score": score, "item_type": item_type, "updated_at": datetime.utcnow()}},
+                    upsert=True
+                )
+                for user_id, score in latest.items()
+            ]
+            await rating_collection.bulk_write(operations, ordered=False)
+            await collection.update_one({"_id": item["_id"]}, {"$unset": {"ratings": ""}})
+            moved += len(operations)
+        stats = await rating_stats({"item_type": item_type})
+        operations = []
+        async for item in collection.find({}, {"_id": 1}):
+            values = stats.get(item["_id"], EMPTY_RATING_STATS)
+            operations.append(UpdateOne({"_id": item["_id"]}, {"$set": values}))
+            if len(operations) >= BATCH_SIZE:
+                await collection.bulk_write(operations, ordered=False)
+                operations = []
+        if operations:
+            await collection.bulk_write(operations, ordered=False)
+    print(f"Moved {moved} embedded ratings and rebuilt rating statistics")
+
+async def write_snapshot():
+    # Importing the routers registers the catalogs to include.
+    from routers import foods, drinks
+    from snapshot import build_snapshot, write_snapshot_file, CATALOG_SNAPSHOT_PATH
+    if not CATALOG_SNAPSHOT_PATH:
+        sys.exit("Set CATALOG_SNAPSHOT_PATH to the file to write")
+    snapshot = await build_snapshot()
+    write_snapshot_file(snapshot, CATALOG_SNAPSHOT_PATH)
+    print(f"Wrote catalog snapshot version {snapshot['version']} to {CATALOG_SNAPSHOT_PATH}")
+
+COMMANDS = {
+    "reconcile-counters": reconcile_counters,
+    "migrate-ratings": migrate_ratings,
+    "write-snapshot": write_snapshot,
+}
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2 or sys.argv[1] not in COMMANDS:
+        sys.exit(f"usage: python maintenance.py {{{'|'.join(COMMANDS)}}}")
+    asyncio.run(COMMANDS[sys.argv[1]]())
\ No newline at end of file
@@ -0,0 +1,166 @@
+from bisect import bisect_left
+from collections import defaultdict
+from time import perf_counter
+from starlette.routing import Match
+from database import RequestTrace, current_trace, command_tracer, pool_monitor
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "0"))
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+DB_CALL_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 500)
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def lines(self, name: str, labels: str) -> list:
+        lines, cumulative = [], 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {self.count}')
+        lines.append(f"{name}_sum{{{labels}}} {self.sum}")
+        lines.append(f"{name}_count{{{labels}}} {self.count}")
+        return lines
+
+def leaf_routes(routes) -> list:
+    # Routers are included without an extra prefix, so leaf paths are already full.
+    leaves = []
+    for route in routes:
+        router = getattr(route, "original_router", None)
+        leaves += leaf_routes(router.routes) if router is not None else [route]
+    return leaves
+
+def route_template(scope) -> str:
+    # Label by path template, not raw path, so ids don't explode cardinality.
+    app = scope["app"]
+    if not hasattr(app.state, "leaf_routes"):
+        app.state.leaf_routes = leaf_routes(app.router.routes)
+    for route in app.state.leaf_routes:
+        match, _ = route.matches(scope)
+        if match != Match.NONE:
+            return route.path
+    return "unmatched"
+
+def label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+class Metrics:
+    def __init__(self):
+        self.requests = defaultdict(int)
+        self.in_flight = defaultdict(int)
+        self.latency = {}
+        self.db_calls = {}
+
+    def started(self, key: tuple):
+        self.in_flight[key] += 1
+
+    def finished(self, key: tuple, status: int, seconds: float, db_calls: int):
+        self.in_flight[key] -= 1
+        self.requests[key + (status,)] += 1
+        if key not in self.latency:
+            self.latency[key] = Histogram(LATENCY_BUCKETS)
+            self.db_calls[key] = Histogram(DB_CALL_BUCKETS)
+        self.latency[key].observe(seconds)
+        self.db_calls[key].observe(db_calls)
+
+    def render(self) -> str:
+        lines = [
+            "# HELP http_requests_total Requests handled, by route and status.",
+            "# TYPE http_requests_total counter",
+        ]
+        for (method, route, status), count in sorted(self.requests.items()):
+            lines.append(f'http_requests_total{{method="{method}",route="{label(route)}",status="{status}"}} {count}')
+        lines += [
+            "# HELP http_requests_in_flight Requests currently being handled.",
+            "# TYPE http_requests_in_flight gauge",
+        ]
+        for (method, route), count in sorted(self.in_flight.items()):
+            lines.append(f'http_requests_in_flight{{method="{method}",route="{label(route)}"}} {count}')
+        for name, help_text, histograms in (
+            ("http_request_duration_seconds", "Request latency.", self.latency),
+            ("http_request_db_commands", "MongoDB commands issued per request.", self.db_calls),
+        ):
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+            for (method, route), histogram in sorted(histograms.items()):
+                lines += histogram.lines(name, f'method="{method}",route="{label(route)}"')
+        totals = sorted(command_tracer.snapshot().items())
+        for index, (name, help_text) in enumerate((
+            ("mongodb_commands_total", "MongoDB commands, attributed to the route that issued them."),
+            ("mongodb_command_failures_total", "Failed MongoDB commands."),
+            ("mongodb_command_duration_seconds_total", "Time spent in MongoDB commands."),
+            ("mongodb_command_documents_total", "Documents returned by MongoDB commands."),
+        )):
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+            for (method, route, command, collection), values in totals:
+                lines.append(
+                    f'{name}{{method="{method}",route="{label(route)}",command="{label(command)}",'
+                    f'collection="{label(collection)}"}} {values[index]}'
+                )
+        lines += [
+            "# HELP mongodb_pool_connections Connections in the MongoDB pool.",
+            "# TYPE mongodb_pool_connections gauge",
+        ]
+        pool = pool_monitor.stats()
+        lines.append(f'mongodb_pool_connections{{state="open"}} {pool["open_connections"]}')
+        lines.append(f'mongodb_pool_connections{{state="in_use"}} {pool["in_use_connections"]}')
+        lines += [
+            "# HELP mongodb_pool_checkouts_total Connection checkouts.",
+            "# TYPE mongodb_pool_checkouts_total counter",
+            f'mongodb_pool_checkouts_total{{result="ok"}} {pool["checkouts"]}',
+            f'mongodb_pool_checkouts_total{{result="failed"}} {pool["failed_checkouts"]}',
+        ]
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        route = route_template(scope)
+        key = (scope["method"], route)
+        trace = RequestTrace(scope["method"], route)
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        metrics.started(key)
+        token = current_trace.set(trace)
+        started = perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = perf_counter() - started
+            current_trace.reset(token)
+            metrics.finished(key, status, elapsed, len(trace.commands))
+            if SLOW_REQUEST_MS and elapsed * 1000 >= SLOW_REQUEST_MS:
+                logger.warning(
+                    "Slow request %s %s -> %s in %.1f ms with %d MongoDB commands: %s",
+                    scope["method"], scope["path"], status, elapsed * 1000, len(trace.commands),
+                    [
+                        {"command": command, "collection": collection, "ms": ms, "documents": documents, "ok": ok}
+                        for command, collection, ms, documents, ok in trace.commands
+                    ],
+                )
@@ -15,7 +15,6 @@ class Food(BaseModel):
     trivia: Optional[str] = None
     vegetarian: Optional[bool] = False
     name_amharic: Optional[str] = None
-    ratings: List[dict] = []
     created_at: datetime = datetime.utcnow()
 
 class Drink(BaseModel):
@@ -26,7 +25,6 @@ class Drink(BaseModel):
     photo_urls: List[str] = []
     trivia: Optional[str] = None
     name_amharic: Optional[str] = None
-    ratings: List[dict] = []
     created_at: datetime = datetime.utcnow()
 
 class User(BaseModel):
@@ -0,0 +1,73 @@
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from fastapi import HTTPException
+from passlib.context import CryptContext
+import asyncio
+import os
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+def _hash(password: str) -> str:
+    return pwd_context.hash(password)
+
+def _verify(password: str, hashed: str) -> bool:
+    return pwd_context.verify(password, hashed)
+
+class HashPool:
+    def __init__(self, workers: int, max_queue: int, use_processes: bool = False):
+        self.workers = workers
+        self.max_queue = max_queue
+        executor_class = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+        self.executor = executor_class(max_workers=workers)
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.rejected = 0
+
+    def _release(self, future):
+        self.in_flight -= 1
+        if future.cancelled():
+            self.cancelled += 1
+        elif future.exception() is not None:
+            self.failed += 1
+        else:
+            self.completed += 1
+
+    async def run(self, fn, *args):
+        if self.in_flight >= self.workers + self.max_queue:
+            self.rejected += 1
+            raise HTTPException(status_code=429, detail="Too many requests, try again shortly", headers={"Retry-After": "1"})
+        loop = asyncio.get_running_loop()
+        self.in_flight += 1
+        future = self.executor.submit(fn, *args)
+        # Hold the slot until the job itself ends, not the request: a disconnected
+        # client cancels the await, but a running hash keeps its worker busy.
+        future.add_done_callback(lambda done: loop.call_soon_threadsafe(self._release, done))
+        return await asyncio.wrap_future(future)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "in_flight": self.in_flight,
+            "queued": max(0, self.in_flight - self.workers),
+            "completed": self.completed,
+            "failed": self.failed,
+            "cancelled": self.cancelled,
+            "rejected": self.rejected,
+        }
+
+hash_pool = HashPool(
+    workers=int(os.getenv("PASSWORD_HASH_WORKERS", "2")),
+    max_queue=int(os.getenv("PASSWORD_HASH_QUEUE", "16")),
+    use_processes=os.getenv("PASSWORD_HASH_EXECUTOR", "thread") == "process",
+)
+
+async def hash_password(password: str) -> str:
+    return await hash_pool.run(_hash, password)
+
+async def verify_password(password: str, hashed: str) -> bool:
+    return await hash_pool.run(_verify, password, hashed)
\ No newline at end of file
@@ -0,0 +1,122 @@
+from datetime import datetime, timedelta, timezone
+from random import Random, choice, sample, shuffle
+from time import monotonic
+from bson import ObjectId
+import asyncio
+import os
+
+POOL_TTL_SECONDS = float(os.getenv("PICK_POOL_TTL_SECONDS", "60"))
+QUIZ_POOL_SIZE = int(os.getenv("QUIZ_POOL_SIZE", "200"))
+QUIZ_OPTIONS = 4
+# Ethiopia has no daylight saving time, so a fixed offset is enough.
+DAILY_TIMEZONE = timezone(timedelta(hours=float(os.getenv("DAILY_UTC_OFFSET_HOURS", "3"))))
+
+pools = []
+
+class ItemPool:
+    def __init__(self, cache, fields=()):
+        self.cache = cache
+        self.fields = fields
+        self.docs = []
+        self.version = None
+        self.loaded_at = 0.0
+        self.lock = asyncio.Lock()
+        self.refreshes = 0
+        pools.append(self)
+
+    def stale(self) -> bool:
+        # Ratings and counters don't change membership; the TTL picks up edits
+        # and writes made by other workers.
+        return self.version != self.cache.membership_version or monotonic() - self.loaded_at > POOL_TTL_SECONDS
+
+    async def load(self) -> list:
+        if self.stale():
+            async with self.lock:
+                if self.stale():
+                    version = self.cache.membership_version
+                    if self.cache.ready:
+                        docs = [
+                            {"_id": ObjectId(item_id), **{field: item.get(field) for field in self.fields}}
+                            for item_id, item in self.cache.items.items()
+                        ]
+                    else:
+                        projection = {field: 1 for field in ("_id", *self.fields)}
+                        docs = await self.cache.collection.find({}, projection).sort("_id", 1).to_list(None)
+                    self.docs, self.version, self.loaded_at = docs, version, monotonic()
+                    self.refreshes += 1
+        return self.docs
+
+    async def random(self):
+        for _ in range(2):
+            docs = await self.load()
+            if not docs:
+                return None
+            item = await self.cache.get(str(choice(docs)["_id"]))
+            if item:
+                return item
+            # Deleted since the pool was built.
+            self.version = None
+        return None
+
+    def stats(self) -> dict:
+        return {"size": len(self.docs), "refreshes": self.refreshes}
+
+def build_quiz_sets(docs: list) -> list:
+    names = [doc["name"] for doc in docs]
+    answers = [doc for doc in docs if doc.get("ingredients")] or docs
+    sets = []
+    for _ in range(min(QUIZ_POOL_SIZE, len(answers) * QUIZ_OPTIONS)):
+        correct = choice(answers)
+        others = [names[i] for i in sample(range(len(names)), min(QUIZ_OPTIONS, len(names))) if names[i] != correct["name"]]
+        options = others[:QUIZ_OPTIONS - 1] + [correct["name"]]
+        shuffle(options)
+        sets.append({
+            "ingredients": correct.get("ingredients", []),
+            "options": options,
+            "correct_answer": correct["name"],
+        })
+    return sets
+
+class QuizPool:
+    def __init__(self, pool: ItemPool):
+        self.pool = pool
+        self.sets = []
+        self.built_from = None
+
+    async def draw(self, count: int) -> list:
+        docs = await self.pool.load()
+        if docs is not self.built_from:
+            self.sets = build_quiz_sets(docs)
+            self.built_from = docs
+        return sample(self.sets, min(count, len(self.sets)))
+
+class DailyPick:
+    def __init__(self, *pools: ItemPool):
+        self.pools = pools
+        self.day = None
+        self.item = None
+
+    async def get(self):
+        today = datetime.now(DAILY_TIMEZONE).date()
+        if self.day != today or self.item is None:
+            self.item = None
+            for _ in range(2):
+                candidates = []
+                for pool in self.pools:
+                    candidates += [(str(doc["_id"]), pool.cache) for doc in await pool.load()]
+                if not candidates:
+                    return None
+                candidates.sort(key=lambda candidate: candidate[0])
+                # Seeding with the date gives every worker the same pick all day.
+                item_id, cache = Random(today.isoformat()).choice(candidates)
+                self.item = await cache.get(item_id)
+                if self.item:
+                    break
+                # Deleted since the pools were built; re-pick from fresh ones.
+                for pool in self.pools:
+                    pool.version = None
+            self.day = today
+        return self.item
+
+def pick_stats() -> dict:
+    return {pool.cache.name: pool.stats() for pool in pools}
\ No newline at end of file
@@ -0,0 +1,256 @@
+from collections import Counter
+from datetime import datetime
+from time import perf_counter
+from typing import Optional
+from bson import ObjectId
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from database import rating_collection
+import asyncio
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+RATING_WRITE_BEHIND = os.getenv("RATING_WRITE_BEHIND", "0") == "1"
+RATING_FLUSH_MS = float(os.getenv("RATING_FLUSH_MS", "5"))
+RATING_BUFFER_MAX = int(os.getenv("RATING_BUFFER_MAX", "1000"))
+# Failed flushes back off exponentially up to this delay.
+RATING_RETRY_MAX_SECONDS = float(os.getenv("RATING_RETRY_MAX_SECONDS", "30"))
+DUPLICATE_KEY = 11000
+EMPTY_RATING_STATS = {"rating_count": 0, "rating_sum": 0, "rating_hist": {}, "rating_avg": None}
+
+def _increment(field: str, amount: int) -> dict:
+    return {"$add": [{"$ifNull": [f"${field}", 0]}, amount]}
+
+def rating_stats_delta(count: int, total: int, hist: dict) -> list:
+    changes = {
+        "rating_count": _increment("rating_count", count),
+        "rating_sum": _increment("rating_sum", total),
+    }
+    for score, amount in hist.items():
+        if amount:
+            changes[f"rating_hist.{score}"] = _increment(f"rating_hist.{score}", amount)
+    return [
+        {"$set": changes},
+        {"$set": {
+            "rating_avg": {"$divide": ["$rating_sum", "$rating_count"]},
+            # Drop buckets that fall to zero, matching rating_stats().
+            "rating_hist": {"$arrayToObject": {"$filter": {
+                "input": {"$objectToArray": "$rating_hist"},
+                "cond": {"$gt": ["$$this.v", 0]},
+            }}},
+        }},
+    ]
+
+def rating_stats_update(previous: Optional[int], score: int) -> list:
+    hist = Counter({score: 1})
+    if previous:
+        hist[previous] -= 1
+    return rating_stats_delta(0 if previous else 1, score - (previous or 0), hist)
+
+async def rating_stats(match: dict) -> dict:
+    # Statistics per item id, recomputed from the stored ratings.
+    pipeline = [
+        {"$match": match},
+        {"$group": {"_id": {"item": "$item_id", "score": "$score"}, "count": {"$sum": 1}}},
+    ]
+    stats = {}
+    async for row in rating_collection.aggregate(pipeline):
+        item = stats.setdefault(row["_id"]["item"], {"rating_count": 0, "rating_sum": 0, "rating_hist": {}})
+        item["rating_count"] += row["count"]
+        item["rating_sum"] += row["count"] * row["_id"]["score"]
+        item["rating_hist"][str(row["_id"]["score"])] = row["count"]
+    for item in stats.values():
+        item["rating_avg"] = item["rating_sum"] / item["rating_count"]
+    return stats
+
+async def _upsert_rating(item_oid: ObjectId, item_type: str, user_id: str, score: int):
+    return await rating_collection.find_one_and_update(
+        {"item_id": item_oid, "user_id": user_id},
+        {"$set": {"score": score, "item_type": item_type, "updated_at": datetime.utcnow()}},
+        upsert=True,
+        return_document=ReturnDocument.BEFORE
+    )
+
+async def save_rating(collection, item_oid: ObjectId, item_type: str, user_id: str, score: int) -> Optional[dict]:
+    try:
+        previous = await _upsert_rating(item_oid, item_type, user_id, score)
+    except DuplicateKeyError:
+        # Lost an upsert race with the same user's concurrent rating.
+        previous = await _upsert_rating(item_oid, item_type, user_id, score)
+    previous_score = previous["score"] if previous else None
+    if previous_score == score:
+        return None
+    return await collection.find_one_and_update(
+        {"_id": item_oid},
+        rating_stats_update(previous_score, score),
+        return_document=ReturnDocument.AFTER
+    )
+
+class RatingBuffer:
+    # Coalesces rating events and writes them in bulk. A user re-rating the same
+    # item before a flush only costs one write, and item statistics get one
+    # delta update per item per flush instead of one per rating. Each rating is
+    # swapped in only if the stored score is still the one the delta was
+    # computed from, so a retried flush or a racing worker can't count it twice.
+    def __init__(self, enabled: bool = RATING_WRITE_BEHIND):
+        self.enabled = enabled
+        self.targets = {}
+        self.pending = {}
+        # Statistics deltas of stored ratings that are not applied yet.
+        self.deltas = {}
+        self.lock = asyncio.Lock()
+        self.wakeup = asyncio.Event()
+        self.events = 0
+        self.flushes = 0
+        self.written = 0
+        self.errors = 0
+        self.failures = 0
+        self.last_flush_ms = 0.0
+
+    def register(self, item_type: str, collection, cache):
+        self.targets[item_type] = (collection, cache)
+
+    async def add(self, item_type: str, item_id: str, user_id: str, score: int):
+        self.events += 1
+        self.pending[(item_type, item_id, user_id)] = score
+        # While MongoDB is failing, leave retries to the backoff in run().
+        if len(self.pending) >= RATING_BUFFER_MAX and not self.failures:
+            await self.flush()
+        else:
+            self.wakeup.set()
+
+    def retry_delay(self) -> float:
+        if not self.failures:
+            return RATING_FLUSH_MS / 1000
+        return min(RATING_RETRY_MAX_SECONDS, RATING_FLUSH_MS / 1000 * 2 ** self.failures)
+
+    async def run(self):
+        while True:
+            await self.wakeup.wait()
+            await asyncio.sleep(self.retry_delay())
+            # Shutdown cancels this task; let an in-progress flush finish.
+            await asyncio.shield(self.flush())
+
+    def _failed(self, message: str, *args):
+        self.errors += 1
+        self.failures += 1
+        if self.failures == 1:
+            logger.exception(message, *args)
+        else:
+            logger.warning(message + " (%d failures in a row, retrying in %.2fs)", *args, self.failures, self.retry_delay())
+        self.wakeup.set()
+
+    async def flush(self):
+        async with self.lock:
+            self.wakeup.clear()
+            batch, self.pending = self.pending, {}
+            if not batch and not self.deltas:
+                return
+            started = perf_counter()
+            try:
+                previous = await self._store(batch)
+            except Exception:
+                # Nothing was counted yet, so the batch is simply retried.
+                # Newer ratings that arrived meanwhile win over the failed ones.
+                for key, score in batch.items():
+                    self.pending.setdefault(key, score)
+                self._failed("Rating flush of %d events failed", len(batch))
+                return
+            for key, score in batch.items():
+                self._add_delta(key[:2], previous[key], score)
+            self.written += len(batch)
+            try:
+                await self._apply_deltas()
+            except Exception:
+                self._failed("Rating statistics update of %d items failed", len(self.deltas))
+                return
+            self.failures = 0
+            self.flushes += 1
+            self.last_flush_ms = (perf_counter() - started) * 1000
+
+    def _add_delta(self, key: tuple, previous: Optional[int], score: int):
+        if previous == score:
+            return
+        count, total, hist = self.deltas.pop(key, (0, 0, Counter()))
+        hist[score] += 1
+        if previous:
+            hist[previous] -= 1
+        count, total = count + (0 if previous else 1), total + score - (previous or 0)
+        if count or total or any(hist.values()):
+            self.deltas[key] = (count, total, hist)
+
+    async def _store(self, batch: dict) -> dict:
+        # Upserts each rating only if its stored score is still the one just read,
+        # and returns the score each upsert replaced. A conflicting write makes the
+        # upsert collide with the existing rating, which is then read again.
+        now = datetime.utcnow()
+        previous = {}
+        remaining = list(batch)
+        while remaining:
+            stored = {}
+            query = {"$or": [{"item_id": ObjectId(item_id), "user_id": user_id} for _, item_id, user_id in remaining]}
+            async for rating in rating_collection.find(query, {"item_id": 1, "user_id": 1, "score": 1}):
+                stored[(str(rating["item_id"]), rating["user_id"])] = rating.get("score")
+            operations = []
+            for item_type, item_id, user_id in remaining:
+                score = stored.get((item_id, user_id))
+                operations.append(UpdateOne(
+                    {"item_id": ObjectId(item_id), "user_id": user_id, "score": score if score is not None else {"$exists": False}},
+                    {"$set": {"score": batch[(item_type, item_id, user_id)], "item_type": item_type, "updated_at": now}},
+                    upsert=True
+                ))
+            conflicts = set()
+            try:
+                await rating_collection.bulk_write(operations, ordered=False)
+            except BulkWriteError as error:
+                if any(e["code"] != DUPLICATE_KEY for e in error.details["writeErrors"]):
+                    raise
+                conflicts = {e["index"] for e in error.details["writeErrors"]}
+            for index, (item_type, item_id, user_id) in enumerate(remaining):
+                if index not in conflicts:
+                    previous[(item_type, item_id, user_id)] = stored.get((item_id, user_id))
+            remaining = [key for index, key in enumerate(remaining) if index in conflicts]
+        return previous
+
+    async def _apply_deltas(self):
+        deltas, self.deltas = self.deltas, {}
+        failed = {}
+        for item_type, (collection, cache) in self.targets.items():
+            keys = [key for key in deltas if key[0] == item_type]
+            if not keys:
+                continue
+            operations = [UpdateOne({"_id": ObjectId(item_id)}, rating_stats_delta(*deltas[(kind, item_id)])) for kind, item_id in keys]
+            try:
+                await collection.bulk_write(operations, ordered=False)
+            except BulkWriteError as error:
+                failed.update((keys[e["index"]], deltas[keys[e["index"]]]) for e in error.details["writeErrors"])
+            except Exception:
+                # Unknown outcome; keep the deltas. `python maintenance.py migrate-ratings`
+                # recomputes the statistics should any have been applied after all.
+                failed.update((key, deltas[key]) for key in keys)
+                continue
+            written = [ObjectId(item_id) for kind, item_id in keys if (kind, item_id) not in failed]
+            async for doc in collection.find({"_id": {"$in": written}}):
+                cache.put(doc)
+        # flush() holds the lock, so nothing was queued meanwhile.
+        self.deltas = failed
+        if failed:
+            raise RuntimeError(f"{len(failed)} item statistics updates failed")
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "pending": len(self.pending),
+            "events": self.events,
+            "flushes": self.flushes,
+            "written": self.written,
+            "coalesced": self.events - self.written - len(self.pending),
+            "errors": self.errors,
+            "failures": self.failures,
+            "unapplied_deltas": len(self.deltas),
+            "last_flush_ms": round(self.last_flush_ms, 3),
+        }
+
+rating_buffer = RatingBuffer()
@@ -0,0 +1,322 @@
+from collections import Counter
+from time import monotonic, perf_counter
+from typing import Optional
+from bson import ObjectId
+from database import user_collection
+import asyncio
+import logging
+import os
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger(__name__)
+
+# Changed user lists are folded into the model this often.
+UPDATE_INTERVAL_SECONDS = float(os.getenv("RECOMMENDER_UPDATE_SECONDS", "10"))
+# Catalog changes need a full build, at most this often.
+REBUILD_INTERVAL_SECONDS = float(os.getenv("RECOMMENDER_REBUILD_SECONDS", "300"))
+# Other workers' writes don't mark this worker dirty, so rebuild at least this often.
+MAX_MODEL_AGE_SECONDS = float(os.getenv("RECOMMENDER_MAX_AGE_SECONDS", "3600"))
+NEIGHBORS = int(os.getenv("RECOMMENDER_NEIGHBORS", "50"))
+CONTENT_WEIGHT = float(os.getenv("RECOMMENDER_CONTENT_WEIGHT", "0.3"))
+POPULARITY_WEIGHT = 0.05
+FAVORITE_WEIGHT = 2.0
+TRIED_WEIGHT = 1.0
+MAX_ITEMS_PER_USER = 500
+MAX_INGREDIENT_FEATURES = 128
+CONTENT_FIELDS = ("type", "region", "ingredients", "vegetarian", "spicy_level")
+FEATURE_WEIGHTS = {"type": 0.5, "region": 1.0, "ingredient": 1.0, "vegetarian": 0.5, "spicy_level": 0.5}
+
+def item_features(doc: dict) -> list:
+    features = [("type", doc.get("type")), ("region", doc.get("region")), ("spicy_level", doc.get("spicy_level"))]
+    if doc.get("vegetarian"):
+        features.append(("vegetarian", True))
+    features += [("ingredient", ingredient.casefold()) for ingredient in doc.get("ingredients") or []]
+    return [feature for feature in features if feature[1] is not None]
+
+def content_matrix(item_features_list: list):
+    # Items sharing no ingredient can still match on region, type or spice.
+    ingredients = Counter(value for features in item_features_list for field, value in features if field == "ingredient")
+    kept = {("ingredient", value) for value, _ in ingredients.most_common(MAX_INGREDIENT_FEATURES)}
+    columns = {}
+    for features in item_features_list:
+        for feature in features:
+            if (feature[0] != "ingredient" or feature in kept) and feature not in columns:
+                columns[feature] = len(columns)
+    matrix = np.zeros((len(item_features_list), max(1, len(columns))), dtype=np.float32)
+    for row, features in enumerate(item_features_list):
+        ingredient_count = sum(1 for field, _ in features if field == "ingredient") or 1
+        for feature in features:
+            if feature in columns:
+                # Spread the ingredient weight so long recipes don't dominate.
+                weight = FEATURE_WEIGHTS[feature[0]] / (ingredient_count if feature[0] == "ingredient" else 1)
+                matrix[row, columns[feature]] = weight
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms > 0)
+
+def user_weights(user: dict, positions: dict) -> tuple:
+    weights = {}
+    for field, weight in (("tried_items", TRIED_WEIGHT), ("favorites", FAVORITE_WEIGHT)):
+        for item_id in (user.get(field) or [])[-MAX_ITEMS_PER_USER:]:
+            position = positions.get(str(item_id))
+            if position is not None:
+                weights[position] = max(weight, weights.get(position, 0))
+    return (np.fromiter(weights, dtype=np.int64, count=len(weights)),
+            np.fromiter(weights.values(), dtype=np.float64, count=len(weights)))
+
+class UserItemMatrix:
+    # The user-item matrix in CSR and CSC form. Users whose lists change after
+    # it was built are masked out of the arrays and kept in a small overlay, so
+    # an update only touches the items in the changed lists.
+    def __init__(self, user_lists: dict, item_count: int):
+        self.rows = {user_id: row for row, user_id in enumerate(user_lists)}
+        lists = list(user_lists.values())
+        self.lengths = np.array([len(items) for items, _ in lists], dtype=np.int64)
+        self.indptr = np.concatenate(([0], np.cumsum(self.lengths)))
+        self.indices = np.concatenate([items for items, _ in lists] or [np.zeros(0, dtype=np.int64)])
+        self.data = np.concatenate([weights for _, weights in lists] or [np.zeros(0)])
+        rows = np.repeat(np.arange(len(lists)), self.lengths)
+        order = np.argsort(self.indices, kind="stable")
+        self.item_users, self.item_weights = rows[order], self.data[order]
+        self.item_indptr = np.concatenate(([0], np.cumsum(np.bincount(self.indices, minlength=item_count))))
+        self.norms_sq = np.bincount(self.indices, weights=self.data * self.data, minlength=item_count)
+        self.replaced = np.zeros(len(lists), dtype=bool)
+        self.overlay = {}
+        self.overlay_items = {}
+
+    @property
+    def users(self) -> int:
+        return int(np.count_nonzero(self.lengths[~self.replaced])) + len(self.overlay)
+
+    def set_user(self, user_id: str, items, weights) -> set:
+        # Returns the items whose co-occurrence changed.
+        previous = self.overlay.pop(user_id, None)
+        if previous is None:
+            row = self.rows.get(user_id)
+            if row is not None and not self.replaced[row]:
+                self.replaced[row] = True
+                start, end = self.indptr[row], self.indptr[row + 1]
+                previous = (self.indices[start:end], self.data[start:end])
+        touched = set(items.tolist())
+        if previous is not None:
+            touched.update(previous[0].tolist())
+            np.subtract.at(self.norms_sq, previous[0], previous[1] ** 2)
+            for item in previous[0].tolist():
+                self.overlay_items.get(item, set()).discard(user_id)
+        if len(items):
+            self.overlay[user_id] = (items, weights, dict(zip(items.tolist(), weights.tolist())))
+            np.add.at(self.norms_sq, items, weights ** 2)
+            for item in items.tolist():
+                self.overlay_items.setdefault(item, set()).add(user_id)
+        return touched
+
+    def neighbors(self, item: int, k: int) -> tuple:
+        start, end = self.item_indptr[item], self.item_indptr[item + 1]
+        users, item_weights = self.item_users[start:end], self.item_weights[start:end]
+        kept = ~self.replaced[users]
+        users, item_weights = users[kept], item_weights[kept]
+        starts, counts = self.indptr[users], self.lengths[users]
+        # Gather the concatenated rows of every user who has this item.
+        gathered = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        others = [self.indices[gathered]]
+        products = [self.data[gathered] * np.repeat(item_weights, counts)]
+        for user_id in self.overlay_items.get(item, ()):
+            items, weights, lookup = self.overlay[user_id]
+            others.append(items)
+            products.append(weights * lookup[item])
+        others, inverse = np.unique(np.concatenate(others), return_inverse=True)
+        co = np.bincount(inverse, weights=np.concatenate(products), minlength=len(others))
+        norms = np.sqrt(np.maximum(self.norms_sq[item], 0) * np.maximum(self.norms_sq[others], 0))
+        scores = np.divide(co, norms, out=np.zeros(len(co)), where=norms > 0)
+        scores[others == item] = 0
+        top = np.argpartition(-scores, k - 1)[:k] if len(scores) > k else np.arange(len(scores))
+        top = top[scores[top] > 0]
+        return others[top], scores[top]
+
+class ItemModel:
+    def __init__(self, keys: list, items: list, users: dict):
+        # items are serialized catalog items; users maps user ids to raw documents.
+        self.keys = keys
+        self.positions = {item_id: position for position, (_, item_id) in enumerate(keys)}
+        self.kinds = np.array([kind for kind, _ in keys])
+        self.item_features = [item_features(item) for item in items]
+        self.features = content_matrix(self.item_features)
+        self.k = min(NEIGHBORS, max(0, len(keys) - 1))
+        user_lists = {user_id: user_weights(user, self.positions) for user_id, user in users.items()}
+        self.matrix = UserItemMatrix({user_id: lists for user_id, lists in user_lists.items() if len(lists[0])}, len(keys))
+        self.graph = self._fill(range(len(keys)), np.zeros((len(keys), self.k), dtype=np.int32),
+                                np.zeros((len(keys), self.k), dtype=np.float32))
+        popularity = np.log1p(np.array([item.get("tried_count", 0) + item.get("favorite_count", 0) for item in items], dtype=np.float32))
+        self.popularity = popularity / popularity.max() if len(items) and popularity.max() > 0 else popularity
+        self.users = self.matrix.users
+
+    def _fill(self, items, neighbors, similarities) -> tuple:
+        if self.k:
+            for item in items:
+                others, scores = self.matrix.neighbors(item, self.k)
+                neighbors[item], similarities[item] = 0, 0
+                neighbors[item, :len(others)] = others
+                similarities[item, :len(others)] = scores
+        return neighbors, similarities
+
+    def update_users(self, users: dict) -> int:
+        # Runs in a worker thread. Only the touched items' rows are recomputed, on
+        # copies that are swapped in together. Items that merely share a neighbour
+        # with them keep their old normalisation until the next full build.
+        touched = set()
+        for user_id, user in users.items():
+            touched |= self.matrix.set_user(user_id, *user_weights(user or {}, self.positions))
+        neighbors, similarities = self.graph
+        self.graph = self._fill(sorted(touched), neighbors.copy(), similarities.copy())
+        self.users = self.matrix.users
+        return len(touched)
+
+    def user_profile(self, favorites: list, tried: list) -> dict:
+        weights = {}
+        for item_ids, weight in ((tried[-MAX_ITEMS_PER_USER:], TRIED_WEIGHT), (favorites[-MAX_ITEMS_PER_USER:], FAVORITE_WEIGHT)):
+            for item_id in item_ids:
+                position = self.positions.get(item_id)
+                if position is not None:
+                    weights[position] = max(weight, weights.get(position, 0))
+        return weights
+
+    def recommend(self, favorites: list, tried: list, kind: Optional[str], limit: int) -> list:
+        if not self.keys:
+            return []
+        profile = self.user_profile(favorites, tried)
+        scores = POPULARITY_WEIGHT * self.popularity
+        if profile:
+            seen = np.fromiter(profile, dtype=np.int64)
+            weights = np.fromiter(profile.values(), dtype=np.float32)
+            neighbors, similarities = self.graph
+            collaborative = np.zeros(len(self.keys), dtype=np.float32)
+            np.add.at(collaborative, neighbors[seen].ravel(), (similarities[seen] * weights[:, None]).ravel())
+            if collaborative.max() > 0:
+                collaborative /= collaborative.max()
+            taste = weights @ self.features[seen]
+            taste_norm = np.linalg.norm(taste)
+            content = self.features @ (taste / taste_norm) if taste_norm > 0 else 0
+            scores = scores + (1 - CONTENT_WEIGHT) * collaborative + CONTENT_WEIGHT * content
+            scores[seen] = -np.inf
+        if kind:
+            scores = np.where(self.kinds == kind, scores, -np.inf)
+        count = min(limit, len(scores))
+        top = np.argpartition(-scores, count - 1)[:count]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(*self.keys[position], round(float(scores[position]), 4)) for position in top if np.isfinite(scores[position])]
+
+def fit(catalog: list, users: dict) -> ItemModel:
+    # catalog: [(kind, serializer or None, docs)]. Runs in a worker thread.
+    keys, items = [], []
+    for kind, serializer, docs in catalog:
+        for doc in docs:
+            item = serializer(doc) if serializer else doc
+            keys.append((kind, item["id"]))
+            items.append(item)
+    return ItemModel(keys, items, users)
+
+class Recommender:
+    def __init__(self, caches):
+        self.caches = {cache.name: cache for cache in caches}
+        self.model = None
+        self.dirty = False
+        self.changed_users = set()
+        self.built_at = 0.0
+        self.build_seconds = 0.0
+        self.builds = 0
+        self.updates = 0
+        self.update_seconds = 0.0
+        for cache in caches:
+            cache.listeners.append(self.on_change)
+
+    @property
+    def available(self) -> bool:
+        return np is not None and self.model is not None
+
+    def mark_dirty(self):
+        self.dirty = True
+
+    def user_changed(self, user_id: str):
+        self.changed_users.add(user_id)
+
+    def on_change(self, cache, item_id: Optional[str], serialized: Optional[dict]):
+        # Only new, removed or re-described items need a full build; ratings and
+        # counters just age the popularity prior until the next one.
+        model = self.model
+        position = model.positions.get(item_id) if model is not None and item_id else None
+        if position is None or serialized is None or item_features(serialized) != model.item_features[position]:
+            self.mark_dirty()
+
+    async def build(self):
+        if np is None:
+            logger.warning("NumPy is not installed; /recommendation/for-me is disabled")
+            return
+        # Changes made while loading are picked up by the next build or update.
+        self.dirty = False
+        self.changed_users.clear()
+        started = perf_counter()
+        catalog = []
+        projection = {field: 1 for field in ("name", *CONTENT_FIELDS, "tried_count", "favorite_count")}
+        for name, cache in self.caches.items():
+            if cache.ready:
+                catalog.append((name, None, list(cache.items.values())))
+            else:
+                catalog.append((name, cache.serializer, await cache.collection.find({}, projection).to_list(None)))
+        users = {str(user["_id"]): user async for user in user_collection.find({}, {"favorites": 1, "tried_items": 1})}
+        self.model = await asyncio.to_thread(fit, catalog, users)
+        self.built_at = monotonic()
+        self.build_seconds = perf_counter() - started
+        self.builds += 1
+
+    async def update(self):
+        user_ids, self.changed_users = self.changed_users, set()
+        # Users missing from the result were deleted and drop out of the model.
+        users = dict.fromkeys(user_ids)
+        try:
+            started = perf_counter()
+            query = {"_id": {"$in": [ObjectId(user_id) for user_id in user_ids]}}
+            async for user in user_collection.find(query, {"favorites": 1, "tried_items": 1}):
+                users[str(user["_id"])] = user
+            await asyncio.to_thread(self.model.update_users, users)
+        except Exception:
+            self.changed_users |= user_ids
+            raise
+        self.update_seconds = perf_counter() - started
+        self.updates += 1
+
+    async def run(self):
+        if np is None:
+            return
+        while True:
+            await asyncio.sleep(UPDATE_INTERVAL_SECONDS)
+            age = monotonic() - self.built_at
+            try:
+                if self.model is None or age > MAX_MODEL_AGE_SECONDS or (self.dirty and age > REBUILD_INTERVAL_SECONDS):
+                    await self.build()
+                elif self.changed_users:
+                    await self.update()
+            except Exception:
+                logger.exception("Recommendation model update failed")
+
+    def recommend(self, favorites: list, tried: list, kind: Optional[str] = None, limit: int = 20) -> list:
+        return self.model.recommend(favorites, tried, kind, limit)
+
+    def stats(self) -> dict:
+        if not self.available:
+            return {"available": False}
+        return {
+            "available": True,
+            "items": len(self.model.keys),
+            "users": self.model.users,
+            "features": self.model.features.shape[1],
+            "builds": self.builds,
+            "build_seconds": round(self.build_seconds, 3),
+            "updates": self.updates,
+            "update_seconds": round(self.update_seconds, 3),
+            "pending_users": len(self.changed_users),
+            "age_seconds": round(monotonic() - self.built_at, 1),
+            "dirty": self.dirty,
+        }
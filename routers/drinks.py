@@ -1,9 +1,17 @@
-from fastapi import APIRouter, HTTPException, Depends
-from typing import Optional
+from fastapi import APIRouter, HTTPException, Depends, Query, Request
+from fastapi.responses import StreamingResponse
+from typing import Optional, Literal
 from bson import ObjectId
+from pymongo import ReturnDocument
 from models import Drink, Rating
-from database import drink_collection
-from routers.users import get_current_user
+from database import drink_collection, rating_collection
+from ratings import save_rating, rating_buffer
+from catalog import CatalogCache, localize
+from cache import single_flight
+from snapshot import record_change, record_reset
+from bulk import import_ndjson
+from picks import ItemPool
+from routers.users import get_current_identity
 
 router = APIRouter(prefix="/drinks", tags=["drinks"])
 
@@ -17,100 +25,134 @@ def drink_serializer(drink) -> dict:
         "photo_urls": drink.get("photo_urls", []),
         "trivia": drink.get("trivia"),
         "name_amharic": drink.get("name_amharic"),
-        "ratings": drink.get("ratings", []),
-        "created_at": str(drink.get("created_at")),
+        "rating_count": drink.get("rating_count", 0),
+        "rating_avg": drink.get("rating_avg"),
+        "rating_hist": drink.get("rating_hist", {}),
+        "tried_count": drink.get("tried_count", 0),
+        "favorite_count": drink.get("favorite_count", 0),
+        "created_at": str(drink["created_at"]) if drink.get("created_at") else None,
     }
 
+drink_cache = CatalogCache("drinks", drink_collection, drink_serializer, index_fields=("region",))
+rating_buffer.register("drink", drink_collection, drink_cache)
+drink_cache.listeners.append(single_flight.forget)
+drink_pool = ItemPool(drink_cache, fields=())
+
 @router.post("/")
-async def create_drink(drink: Drink, user: dict = Depends(get_current_user)):
+async def create_drink(drink: Drink, user: dict = Depends(get_current_identity)):
     new_drink = drink.dict()
-    result = await drink_collection.insert_one(new_drink)
-    created_drink = await drink_collection.find_one({"_id": result.inserted_id})
-    return drink_serializer(created_drink)
+    new_drink["tried_count"] = 0
+    new_drink["favorite_count"] = 0
+    # insert_one sets new_drink["_id"], so the payload is the stored document.
+    await drink_collection.insert_one(new_drink)
+    drink_cache.put(new_drink, created=True)
+    await record_change("drinks", str(new_drink["_id"]), "upsert")
+    return drink_serializer(new_drink)
 
 @router.get("/")
-async def get_drinks(lang: str = "en"):
+async def get_drinks(
+    request: Request,
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    after: Optional[str] = None,
+    fields: Optional[str] = None,
+    view: Literal["summary", "full"] = "summary",
+    format: Literal["json", "ndjson"] = "json",
+    lang: str = "en",
+):
+    filters = {}
+    return await drink_cache.list_response(request, filters, limit, after, fields, view, lang, format)
+
+@router.post("/bulk")
+async def import_drinks(request: Request, user: dict = Depends(get_current_identity)):
+    report = await import_ndjson(request, Drink, drink_collection)
+    if report["inserted"] or report["updated"]:
+        await drink_cache.reload()
+        await record_reset()
+    return report
+
+@router.get("/export")
+async def export_drinks():
+    return StreamingResponse(drink_cache.stream({}, None, drink_cache.fields, "en"), media_type="application/x-ndjson")
+
+@router.get("/popular")
+async def get_popular_drinks(limit: int = Query(10, ge=1, le=100), lang: str = "en"):
     drinks = []
-    async for drink in drink_collection.find():
+    async for drink in drink_collection.find().sort("tried_count", -1).limit(limit):
         serialized = drink_serializer(drink)
         if lang == "am" and drink.get("name_amharic"):
             serialized["name"] = drink["name_amharic"]
         drinks.append(serialized)
     return drinks
 
+@router.get("/top-rated")
+async def get_top_rated_drinks(limit: int = Query(10, ge=1, le=100), min_ratings: int = Query(1, ge=1), lang: str = "en"):
+    drinks = []
+    async for drink in drink_collection.find({"rating_count": {"$gte": min_ratings}}).sort("rating_avg", -1).limit(limit):
+        drinks.append(localize(drink_serializer(drink), lang))
+    return drinks
+
+@router.get("/random")
+async def get_random_drink(lang: str = "en"):
+    drink = await drink_pool.random()
+    if drink:
+        return localize(drink, lang)
+    raise HTTPException(status_code=404, detail="No drinks found")
+
 @router.get("/{drink_id}")
 async def get_drink(drink_id: str, lang: str = "en"):
-    drink = await drink_collection.find_one({"_id": ObjectId(drink_id)})
-    if drink:
-        serialized = drink_serializer(drink)
-        if lang == "am" and drink.get("name_amharic"):
-            serialized["name"] = drink["name_amharic"]
-        return serialized
-    raise HTTPException(status_code=404, detail="Drink not found")
+    async def load():
+        drink = await drink_cache.get(drink_id)
+        if drink:
+            return localize(drink, lang)
+        raise HTTPException(status_code=404, detail="Drink not found")
+
+    return await single_flight.do(("GET /drinks/{id}", drink_id, lang), load)
 
 @router.put("/{drink_id}")
-async def update_drink(drink_id: str, drink: Drink, user: dict = Depends(get_current_user)):
+async def update_drink(drink_id: str, drink: Drink, user: dict = Depends(get_current_identity)):
     update_data = {k: v for k, v in drink.dict().items() if v is not None}
-    result = await drink_collection.update_one({"_id": ObjectId(drink_id)}, {"$set": update_data})
-    if result.modified_count:
-        updated_drink = await drink_collection.find_one({"_id": ObjectId(drink_id)})
+    updated_drink = await drink_collection.find_one_and_update(
+        {"_id": ObjectId(drink_id)},
+        {"$set": update_data},
+        return_document=ReturnDocument.AFTER
+    )
+    if updated_drink:
+        drink_cache.put(updated_drink)
+        await record_change("drinks", drink_id, "upsert")
         return drink_serializer(updated_drink)
     raise HTTPException(status_code=404, detail="Drink not found")
 
 @router.delete("/{drink_id}")
-async def delete_drink(drink_id: str, user: dict = Depends(get_current_user)):
+async def delete_drink(drink_id: str, user: dict = Depends(get_current_identity)):
     result = await drink_collection.delete_one({"_id": ObjectId(drink_id)})
     if result.deleted_count:
+        await rating_collection.delete_many({"item_id": ObjectId(drink_id)})
+        drink_cache.evict(drink_id)
+        await record_change("drinks", drink_id, "delete")
         return {"message": "Drink deleted"}
     raise HTTPException(status_code=404, detail="Drink not found")
 
-@router.get("/random")
-async def get_random_drink(lang: str = "en"):
-    pipeline = [{"$sample": {"size": 1}}]
-    async for drink in drink_collection.aggregate(pipeline):
-        serialized = drink_serializer(drink)
-        if lang == "am" and drink.get("name_amharic"):
-            serialized["name"] = drink["name_amharic"]
-        return serialized
-    raise HTTPException(status_code=404, detail="No drinks found")
-
 @router.post("/{drink_id}/rate")
-async def rate_drink(drink_id: str, rating: Rating, user: dict = Depends(get_current_user)):
+async def rate_drink(drink_id: str, rating: Rating, user: dict = Depends(get_current_identity)):
     if not 1 <= rating.score <= 5:
         raise HTTPException(status_code=400, detail="Score must be 1-5")
-    result = await drink_collection.update_one(
-        {"_id": ObjectId(drink_id)},
-        {"$push": {"ratings": {"user_id": user["id"], "score": rating.score}}}
-    )
-    if result.modified_count:
+    if not await drink_cache.get(drink_id):
+        raise HTTPException(status_code=404, detail="Drink not found")
+    if rating_buffer.enabled:
+        await rating_buffer.add("drink", drink_id, user["id"], rating.score)
         return {"message": "Rating added"}
-    raise HTTPException(status_code=404, detail="Drink not found")
+    updated_drink = await save_rating(drink_collection, ObjectId(drink_id), "drink", user["id"], rating.score)
+    if updated_drink:
+        drink_cache.put(updated_drink)
+    return {"message": "Rating added"}
 
 @router.get("/{drink_id}/share")
 async def share_drink(drink_id: str, lang: str = "en"):
-    drink = await drink_collection.find_one({"_id": ObjectId(drink_id)})
-    if drink:
-        name = drink["name_amharic"] if lang == "am" and drink.get("name_amharic") else drink["name"]
-        return {"share_text": f"Try {name} in Ethiopia! {drink['description']}"}
-    raise HTTPException(status_code=404, detail="Drink not found")
+    async def load():
+        drink = await drink_cache.get(drink_id)
+        if drink:
+            name = drink["name_amharic"] if lang == "am" and drink.get("name_amharic") else drink["name"]
+            return {"share_text": f"Try {name} in Ethiopia! {drink['description']}"}
+        raise HTTPException(status_code=404, detail="Drink not found")
 
-@router.get("/popular")
-async def get_popular_drinks(limit: int = 10, lang: str = "en"):
-    pipeline = [
-        {"$lookup": {
-            "from": "users",
-            "localField": "_id",
-            "foreignField": "tried_items",
-            "as": "tried_by"
-        }},
-        {"$addFields": {"tried_count": {"$size": "$tried_by"}}},
-        {"$sort": {"tried_count": -1}},
-        {"$limit": limit}
-    ]
-    drinks = []
-    async for drink in drink_collection.aggregate(pipeline):
-        serialized = drink_serializer(drink)
-        if lang == "am" and drink.get("name_amharic"):
-            serialized["name"] = drink["name_amharic"]
-        drinks.append(serialized)
-    return drinks
\ No newline at end of file
+    return await single_flight.do(("GET /drinks/{id}/share", drink_id, lang), load)
\ No newline at end of file
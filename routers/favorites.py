@@ -1,62 +1,79 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Query, Response
+from typing import Optional
 from bson import ObjectId
-from database import user_collection, food_collection, drink_collection
-from routers.users import get_current_user
-from routers.foods import food_serializer
-from routers.drinks import drink_serializer
+from pymongo import ReturnDocument
+from database import user_collection
+from catalog import locate, get_items
+from routers.users import get_current_identity, invalidate_user
+from routers.recommendations import recommender
 
 router = APIRouter(tags=["favorites"])
 
-@router.post("/favorites/{item_id}")
-async def add_favorite(item_id: str, user: dict = Depends(get_current_user)):
+async def add_to_list(item_id: str, user: dict, field: str, counter: str):
     item_oid = ObjectId(item_id)
-    if not await food_collection.find_one({"_id": item_oid}) and not await drink_collection.find_one({"_id": item_oid}):
+    cache = await locate(item_id)
+    if cache is None:
         raise HTTPException(status_code=404, detail="Item not found")
     result = await user_collection.update_one(
         {"_id": ObjectId(user["id"])},
-        {"$addToSet": {"favorites": item_oid}}
+        {"$addToSet": {field: item_oid}}
     )
+    if not result.matched_count:
+        raise HTTPException(status_code=404, detail="User not found")
+    # Only count the first time this user adds the item.
     if result.modified_count:
-        return {"message": "Added to favorites"}
-    raise HTTPException(status_code=404, detail="User not found")
+        invalidate_user(user["id"])
+        recommender.user_changed(user["id"])
+        item = await cache.collection.find_one_and_update(
+            {"_id": item_oid},
+            {"$inc": {counter: 1}},
+            return_document=ReturnDocument.AFTER
+        )
+        if item:
+            cache.put(item)
+
+@router.post("/favorites/{item_id}")
+async def add_favorite(item_id: str, user: dict = Depends(get_current_identity)):
+    await add_to_list(item_id, user, "favorites", "favorite_count")
+    return {"message": "Added to favorites"}
 
 @router.post("/tried/{item_id}")
-async def add_tried(item_id: str, user: dict = Depends(get_current_user)):
-    item_oid = ObjectId(item_id)
-    if not await food_collection.find_one({"_id": item_oid}) and not await drink_collection.find_one({"_id": item_oid}):
-        raise HTTPException(status_code=404, detail="Item not found")
-    result = await user_collection.update_one(
-        {"_id": ObjectId(user["id"])},
-        {"$addToSet": {"tried_items": item_oid}}
-    )
-    if result.modified_count:
-        return {"message": "Marked as tried"}
-    raise HTTPException(status_code=404, detail="User not found")
+async def add_tried(item_id: str, user: dict = Depends(get_current_identity)):
+    await add_to_list(item_id, user, "tried_items", "tried_count")
+    return {"message": "Marked as tried"}
+
+async def get_list_page(user: dict, field: str, limit: int, after: Optional[str], response: Response):
+    if after and not ObjectId.is_valid(after):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    stored = await user_collection.find_one({"_id": ObjectId(user["id"])}, {field: 1})
+    if not stored:
+        raise HTTPException(status_code=404, detail="User not found")
+    item_ids = [ObjectId(item_id) for item_id in stored.get(field, [])]
+    start = 0
+    if after:
+        try:
+            start = item_ids.index(ObjectId(after)) + 1
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Unknown cursor")
+    page = item_ids[start:start + limit]
+    if start + limit < len(item_ids):
+        response.headers["X-Next-Cursor"] = str(page[-1])
+    return await get_items([str(item_id) for item_id in page])
 
 @router.get("/favorites")
-async def get_favorites(user: dict = Depends(get_current_user)):
-    user = await user_collection.find_one({"_id": ObjectId(user["id"])})
-    favorites = []
-    for item_id in user.get("favorites", []):
-        food = await food_collection.find_one({"_id": ObjectId(item_id)})
-        if food:
-            favorites.append(food_serializer(food))
-        else:
-            drink = await drink_collection.find_one({"_id": ObjectId(item_id)})
-            if drink:
-                favorites.append(drink_serializer(drink))
-    return favorites
+async def get_favorites(
+    response: Response,
+    limit: int = Query(50, ge=1, le=200),
+    after: Optional[str] = None,
+    user: dict = Depends(get_current_identity),
+):
+    return await get_list_page(user, "favorites", limit, after, response)
 
 @router.get("/tried")
-async def get_tried(user: dict = Depends(get_current_user)):
-    user = await user_collection.find_one({"_id": ObjectId(user["id"])})
-    tried_items = []
-    for item_id in user.get("tried_items", []):
-        food = await food_collection.find_one({"_id": ObjectId(item_id)})
-        if food:
-            tried_items.append(food_serializer(food))
-        else:
-            drink = await drink_collection.find_one({"_id": ObjectId(item_id)})
-            if drink:
-                tried_items.append(drink_serializer(drink))
-    return tried_items
\ No newline at end of file
+async def get_tried(
+    response: Response,
+    limit: int = Query(50, ge=1, le=200),
+    after: Optional[str] = None,
+    user: dict = Depends(get_current_identity),
+):
+    return await get_list_page(user, "tried_items", limit, after, response)
\ No newline at end of file
@@ -1,9 +1,18 @@
-from fastapi import APIRouter, HTTPException, Depends, Query
-from typing import Optional
+from fastapi import APIRouter, HTTPException, Depends, Query, Request
+from fastapi.responses import StreamingResponse
+from typing import Optional, Literal
 from bson import ObjectId
+from pymongo import ReturnDocument
 from models import Food, Rating
-from database import food_collection
-from routers.users import get_current_user
+from database import food_collection, rating_collection
+from ratings import save_rating, rating_buffer
+from catalog import CatalogCache, localize
+from cache import single_flight
+from snapshot import record_change, record_reset
+from bulk import import_ndjson
+from picks import ItemPool, QuizPool
+from routers.users import get_current_identity
+from geo import restaurant_locations, nearby_index, sync_restaurant_locations
 
 router = APIRouter(prefix="/foods", tags=["foods"])
 
@@ -22,120 +31,153 @@ def food_serializer(food) -> dict:
         "trivia": food.get("trivia"),
         "vegetarian": food.get("vegetarian", False),
         "name_amharic": food.get("name_amharic"),
-        "ratings": food.get("ratings", []),
-        "created_at": str(food.get("created_at")),
+        "rating_count": food.get("rating_count", 0),
+        "rating_avg": food.get("rating_avg"),
+        "rating_hist": food.get("rating_hist", {}),
+        "tried_count": food.get("tried_count", 0),
+        "favorite_count": food.get("favorite_count", 0),
+        "created_at": str(food["created_at"]) if food.get("created_at") else None,
     }
 
+food_cache = CatalogCache("foods", food_collection, food_serializer, index_fields=("region", "vegetarian", "spicy_level"))
+rating_buffer.register("food", food_collection, food_cache)
+food_cache.listeners.append(single_flight.forget)
+food_pool = ItemPool(food_cache, fields=("name", "ingredients"))
+quiz_pool = QuizPool(food_pool)
+
 @router.post("/")
-async def create_food(food: Food, user: dict = Depends(get_current_user)):
+async def create_food(food: Food, user: dict = Depends(get_current_identity)):
     new_food = food.dict()
-    result = await food_collection.insert_one(new_food)
-    created_food = await food_collection.find_one({"_id": result.inserted_id})
-    return food_serializer(created_food)
+    new_food["tried_count"] = 0
+    new_food["favorite_count"] = 0
+    new_food["restaurant_locations"] = restaurant_locations(new_food["restaurant_suggestions"])
+    # insert_one sets new_food["_id"], so the payload is the stored document.
+    await food_collection.insert_one(new_food)
+    nearby_index.add(str(new_food["_id"]), new_food["restaurant_locations"])
+    food_cache.put(new_food, created=True)
+    await record_change("foods", str(new_food["_id"]), "upsert")
+    return food_serializer(new_food)
 
 @router.get("/")
-async def get_foods(vegetarian: Optional[bool] = None, spicy_level: Optional[str] = None, lang: str = "en"):
-    query = {}
-    if vegetarian is not None:
-        query["vegetarian"] = vegetarian
-    if spicy_level:
-        query["spicy_level"] = spicy_level
+async def get_foods(
+    request: Request,
+    vegetarian: Optional[bool] = None,
+    spicy_level: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    after: Optional[str] = None,
+    fields: Optional[str] = None,
+    view: Literal["summary", "full"] = "summary",
+    format: Literal["json", "ndjson"] = "json",
+    lang: str = "en",
+):
+    filters = {"vegetarian": vegetarian, "spicy_level": spicy_level or None}
+    return await food_cache.list_response(request, filters, limit, after, fields, view, lang, format)
+
+def set_restaurant_locations(food: dict):
+    food["restaurant_locations"] = restaurant_locations(food.get("restaurant_suggestions"))
+
+@router.post("/bulk")
+async def import_foods(request: Request, user: dict = Depends(get_current_identity)):
+    report = await import_ndjson(request, Food, food_collection, prepare=set_restaurant_locations)
+    if report["inserted"] or report["updated"]:
+        await sync_restaurant_locations()
+        await food_cache.reload()
+        await record_reset()
+    return report
+
+@router.get("/export")
+async def export_foods():
+    return StreamingResponse(food_cache.stream({}, None, food_cache.fields, "en"), media_type="application/x-ndjson")
+
+@router.get("/popular")
+async def get_popular_foods(limit: int = Query(10, ge=1, le=100), lang: str = "en"):
     foods = []
-    async for food in food_collection.find(query):
+    async for food in food_collection.find().sort("tried_count", -1).limit(limit):
         serialized = food_serializer(food)
         if lang == "am" and food.get("name_amharic"):
             serialized["name"] = food["name_amharic"]
         foods.append(serialized)
     return foods
 
+@router.get("/top-rated")
+async def get_top_rated_foods(limit: int = Query(10, ge=1, le=100), min_ratings: int = Query(1, ge=1), lang: str = "en"):
+    foods = []
+    async for food in food_collection.find({"rating_count": {"$gte": min_ratings}}).sort("rating_avg", -1).limit(limit):
+        foods.append(localize(food_serializer(food), lang))
+    return foods
+
+@router.get("/random")
+async def get_random_food(lang: str = "en"):
+    food = await food_pool.random()
+    if food:
+        return localize(food, lang)
+    raise HTTPException(status_code=404, detail="No foods found")
+
+@router.get("/quiz")
+async def get_quiz(count: Optional[int] = Query(None, ge=1, le=50)):
+    quizzes = await quiz_pool.draw(count or 1)
+    if not quizzes:
+        raise HTTPException(status_code=404, detail="No foods found")
+    return quizzes if count else quizzes[0]
+
 @router.get("/{food_id}")
 async def get_food(food_id: str, lang: str = "en"):
-    food = await food_collection.find_one({"_id": ObjectId(food_id)})
-    if food:
-        serialized = food_serializer(food)
-        if lang == "am" and food.get("name_amharic"):
-            serialized["name"] = food["name_amharic"]
-        return serialized
-    raise HTTPException(status_code=404, detail="Food not found")
+    async def load():
+        food = await food_cache.get(food_id)
+        if food:
+            return localize(food, lang)
+        raise HTTPException(status_code=404, detail="Food not found")
+
+    return await single_flight.do(("GET /foods/{id}", food_id, lang), load)
 
 @router.put("/{food_id}")
-async def update_food(food_id: str, food: Food, user: dict = Depends(get_current_user)):
+async def update_food(food_id: str, food: Food, user: dict = Depends(get_current_identity)):
     update_data = {k: v for k, v in food.dict().items() if v is not None}
-    result = await food_collection.update_one({"_id": ObjectId(food_id)}, {"$set": update_data})
-    if result.modified_count:
-        updated_food = await food_collection.find_one({"_id": ObjectId(food_id)})
+    update_data["restaurant_locations"] = restaurant_locations(update_data.get("restaurant_suggestions"))
+    updated_food = await food_collection.find_one_and_update(
+        {"_id": ObjectId(food_id)},
+        {"$set": update_data},
+        return_document=ReturnDocument.AFTER
+    )
+    if updated_food:
+        nearby_index.add(food_id, update_data["restaurant_locations"])
+        food_cache.put(updated_food)
+        await record_change("foods", food_id, "upsert")
         return food_serializer(updated_food)
     raise HTTPException(status_code=404, detail="Food not found")
 
 @router.delete("/{food_id}")
-async def delete_food(food_id: str, user: dict = Depends(get_current_user)):
+async def delete_food(food_id: str, user: dict = Depends(get_current_identity)):
     result = await food_collection.delete_one({"_id": ObjectId(food_id)})
     if result.deleted_count:
+        await rating_collection.delete_many({"item_id": ObjectId(food_id)})
+        food_cache.evict(food_id)
+        await record_change("foods", food_id, "delete")
+        nearby_index.remove(food_id)
         return {"message": "Food deleted"}
     raise HTTPException(status_code=404, detail="Food not found")
 
-@router.get("/random")
-async def get_random_food(lang: str = "en"):
-    pipeline = [{"$sample": {"size": 1}}]
-    async for food in food_collection.aggregate(pipeline):
-        serialized = food_serializer(food)
-        if lang == "am" and food.get("name_amharic"):
-            serialized["name"] = food["name_amharic"]
-        return serialized
-    raise HTTPException(status_code=404, detail="No foods found")
-
-@router.get("/quiz")
-async def get_quiz():
-    pipeline = [{"$sample": {"size": 4}}]
-    foods = []
-    async for food in food_collection.aggregate(pipeline):
-        foods.append(food)
-    if not foods:
-        raise HTTPException(status_code=404, detail="No foods found")
-    correct_food = foods[0]
-    return {
-        "ingredients": correct_food.get("ingredients", []),
-        "options": [f["name"] for f in foods],
-        "correct_answer": correct_food["name"]
-    }
-
 @router.post("/{food_id}/rate")
-async def rate_food(food_id: str, rating: Rating, user: dict = Depends(get_current_user)):
+async def rate_food(food_id: str, rating: Rating, user: dict = Depends(get_current_identity)):
     if not 1 <= rating.score <= 5:
         raise HTTPException(status_code=400, detail="Score must be 1-5")
-    result = await food_collection.update_one(
-        {"_id": ObjectId(food_id)},
-        {"$push": {"ratings": {"user_id": user["id"], "score": rating.score}}}
-    )
-    if result.modified_count:
+    if not await food_cache.get(food_id):
+        raise HTTPException(status_code=404, detail="Food not found")
+    if rating_buffer.enabled:
+        await rating_buffer.add("food", food_id, user["id"], rating.score)
         return {"message": "Rating added"}
-    raise HTTPException(status_code=404, detail="Food not found")
+    updated_food = await save_rating(food_collection, ObjectId(food_id), "food", user["id"], rating.score)
+    if updated_food:
+        food_cache.put(updated_food)
+    return {"message": "Rating added"}
 
 @router.get("/{food_id}/share")
 async def share_food(food_id: str, lang: str = "en"):
-    food = await food_collection.find_one({"_id": ObjectId(food_id)})
-    if food:
-        name = food["name_amharic"] if lang == "am" and food.get("name_amharic") else food["name"]
-        return {"share_text": f"Try {name} in Ethiopia! {food['description']}"}
-    raise HTTPException(status_code=404, detail="Food not found")
+    async def load():
+        food = await food_cache.get(food_id)
+        if food:
+            name = food["name_amharic"] if lang == "am" and food.get("name_amharic") else food["name"]
+            return {"share_text": f"Try {name} in Ethiopia! {food['description']}"}
+        raise HTTPException(status_code=404, detail="Food not found")
 
-@router.get("/popular")
-async def get_popular_foods(limit: int = 10, lang: str = "en"):
-    pipeline = [
-        {"$lookup": {
-            "from": "users",
-            "localField": "_id",
-            "foreignField": "tried_items",
-            "as": "tried_by"
-        }},
-        {"$addFields": {"tried_count": {"$size": "$tried_by"}}},
-        {"$sort": {"tried_count": -1}},
-        {"$limit": limit}
-    ]
-    foods = []
-    async for food in food_collection.aggregate(pipeline):
-        serialized = food_serializer(food)
-        if lang == "am" and food.get("name_amharic"):
-            serialized["name"] = food["name_amharic"]
-        foods.append(serialized)
-    return foods
\ No newline at end of file
+    return await single_flight.do(("GET /foods/{id}/share", food_id, lang), load)
\ No newline at end of file
@@ -1,74 +1,121 @@
-from fastapi import APIRouter, HTTPException
-from typing import Optional
+from fastapi import APIRouter, HTTPException, Query, Depends, Response
+from typing import Optional, Literal
 from bson import ObjectId
-from database import food_collection, drink_collection
-from routers.foods import food_serializer
-from routers.drinks import drink_serializer
+from database import food_collection
+from routers.foods import food_serializer, food_cache, food_pool
+from routers.drinks import drink_cache, drink_pool
+from routers.users import get_current_user
+from catalog import localize, region_facets, DEFAULT_PAGE_SIZE
+from cache import single_flight
+from picks import DailyPick
 from random import choice
-from geopy.distance import geodesic
+import asyncio
+from geo import nearby_index, NEARBY_BACKEND
+from recommender import Recommender
+
+daily_pick = DailyPick(food_pool, drink_pool)
+recommender = Recommender([food_cache, drink_cache])
 
 router = APIRouter(prefix="/recommendation", tags=["recommendations"])
 
 @router.get("/random")
 async def get_random_item(lang: str = "en"):
-    collection = choice([food_collection, drink_collection])
-    pipeline = [{"$sample": {"size": 1}}]
-    async for item in collection.aggregate(pipeline):
-        serialized = food_serializer(item) if collection == food_collection else drink_serializer(item)
-        if lang == "am" and item.get("name_amharic"):
-            serialized["name"] = item["name_amharic"]
-        return serialized
+    item = await choice([food_pool, drink_pool]).random()
+    if item:
+        return localize(item, lang)
     raise HTTPException(status_code=404, detail="No items found")
 
 @router.get("/by-region/{region}")
-async def get_by_region(region: str, lang: str = "en"):
-    items = []
-    async for food in food_collection.find({"region": region}):
-        serialized = food_serializer(food)
-        if lang == "am" and food.get("name_amharic"):
-            serialized["name"] = food["name_amharic"]
-        items.append(serialized)
-    async for drink in drink_collection.find({"region": region}):
-        serialized = drink_serializer(drink)
-        if lang == "am" and drink.get("name_amharic"):
-            serialized["name"] = drink["name_amharic"]
-        items.append(serialized)
-    if not items:
-        raise HTTPException(status_code=404, detail="No items found in this region")
+async def get_by_region(
+    region: str,
+    response: Response,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=500),
+    after: Optional[str] = None,
+    lang: str = "en",
+):
+    if after and not ObjectId.is_valid(after):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    async def load():
+        # Foods and drinks are merged in id order, so one cursor pages through both.
+        foods, drinks = await asyncio.gather(
+            food_cache.find(limit=limit + 1, after=after, region=region),
+            drink_cache.find(limit=limit + 1, after=after, region=region),
+        )
+        items = sorted(foods + drinks, key=lambda item: item["id"])
+        if not items and not after:
+            raise HTTPException(status_code=404, detail="No items found in this region")
+        next_cursor = items[limit - 1]["id"] if len(items) > limit else None
+        return [localize(item, lang) for item in items[:limit]], next_cursor
+
+    items, next_cursor = await single_flight.do(("GET /recommendation/by-region/{region}", region, limit, after, lang), load)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
     return items
 
+@router.get("/regions")
+async def get_region_facets():
+    return await region_facets.get()
+
 @router.get("/daily")
 async def get_daily_suggestion(lang: str = "en"):
-    pipeline = [{"$sample": {"size": 1}}]
-    async for item in food_collection.aggregate(pipeline):
-        serialized = food_serializer(item)
-        if lang == "am" and item.get("name_amharic"):
-            serialized["name"] = item["name_amharic"]
-        return serialized
-    async for item in drink_collection.aggregate(pipeline):
-        serialized = drink_serializer(item)
-        if lang == "am" and item.get("name_amharic"):
-            serialized["name"] = item["name_amharic"]
-        return serialized
+    item = await daily_pick.get()
+    if item:
+        return localize(item, lang)
     raise HTTPException(status_code=404, detail="No items found")
 
+@router.get("/for-me")
+async def get_for_me(
+    type: Optional[Literal["food", "drink"]] = None,
+    limit: int = Query(20, ge=1, le=100),
+    lang: str = "en",
+    user: dict = Depends(get_current_user),
+):
+    if not recommender.available:
+        raise HTTPException(status_code=503, detail="Recommendations are unavailable")
+    hits = recommender.recommend(user["favorites"], user["tried_items"], f"{type}s" if type else None, limit)
+    found = {}
+    for cache in (food_cache, drink_cache):
+        ids = [item_id for kind, item_id, _ in hits if kind == cache.name]
+        if ids:
+            found.update(await cache.get_many(ids))
+    return [{**localize(found[item_id], lang), "score": score} for _, item_id, score in hits if item_id in found]
+
 @router.get("/nearby")
-async def get_nearby_items(lat: float, lon: float, lang: str = "en"):
+async def get_nearby_items(
+    lat: float = Query(..., ge=-90, le=90),
+    lon: float = Query(..., ge=-180, le=180),
+    radius_km: float = Query(10, gt=0, le=500),
+    limit: int = Query(20, ge=1, le=100),
+    lang: str = "en",
+):
+    if NEARBY_BACKEND == "memory":
+        await nearby_index.refresh()
+        hits = nearby_index.nearby(lat, lon, radius_km, limit)
+        foods = {}
+        async for food in food_collection.find({"_id": {"$in": [ObjectId(item_id) for item_id, _ in hits]}}):
+            foods[str(food["_id"])] = food
+        matches = [(foods[item_id], distance) for item_id, distance in hits if item_id in foods]
+    else:
+        pipeline = [
+            {"$geoNear": {
+                "near": {"type": "Point", "coordinates": [lon, lat]},
+                "key": "restaurant_locations",
+                "distanceField": "distance_km",
+                "distanceMultiplier": 0.001,
+                "maxDistance": radius_km * 1000,
+                "spherical": True
+            }},
+            {"$limit": limit}
+        ]
+        matches = [(food, food["distance_km"]) async for food in food_collection.aggregate(pipeline)]
     items = []
-    user_location = (lat, lon)
-    async for food in food_collection.find():
-        for restaurant in food.get("restaurant_suggestions", []):
-            parts = restaurant.split(", ")
-            if len(parts) >= 4:
-                try:
-                    restaurant_location = (float(parts[2]), float(parts[3]))
-                    if geodesic(user_location, restaurant_location).km < 10:
-                        serialized = food_serializer(food)
-                        if lang == "am" and food.get("name_amharic"):
-                            serialized["name"] = food["name_amharic"]
-                        items.append(serialized)
-                except ValueError:
-                    continue
+    for food, distance in matches:
+        serialized = food_serializer(food)
+        if lang == "am" and food.get("name_amharic"):
+            serialized["name"] = food["name_amharic"]
+        serialized["distance_km"] = round(distance, 2)
+        items.append(serialized)
     if not items:
         raise HTTPException(status_code=404, detail="No items found nearby")
     return items
\ No newline at end of file
@@ -0,0 +1,24 @@
+from fastapi import APIRouter, Query
+from typing import Optional, Literal
+from catalog import localize
+from search import SearchIndex
+from routers.foods import food_cache
+from routers.drinks import drink_cache
+
+router = APIRouter(tags=["search"])
+
+search_index = SearchIndex([food_cache, drink_cache])
+
+@router.get("/search")
+async def search(
+    q: str = Query(..., min_length=1, max_length=100),
+    type: Optional[Literal["food", "drink"]] = None,
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+    lang: str = "en",
+):
+    total, results = search_index.search(q, f"{type}s" if type else None, limit, offset)
+    return {
+        "total": total,
+        "results": [{**localize(item, lang), "score": score} for item, score in results],
+    }
\ No newline at end of file
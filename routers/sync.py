@@ -0,0 +1,34 @@
+from fastapi import APIRouter, HTTPException, Query, Request, Response
+from typing import Literal
+from catalog import etag_matches
+from snapshot import changes_since, pack, snapshot_cache, msgpack, SYNC_PAGE_SIZE
+
+router = APIRouter(tags=["sync"])
+
+def require_msgpack():
+    if msgpack is None:
+        raise HTTPException(status_code=503, detail="msgpack is not installed")
+
+@router.get("/sync")
+async def sync(
+    since: int = Query(..., ge=0),
+    limit: int = Query(SYNC_PAGE_SIZE, ge=1, le=5000),
+    format: Literal["json", "msgpack"] = "json",
+):
+    changes = await changes_since(since, limit)
+    if changes is None:
+        raise HTTPException(status_code=410, detail="Catalog was reset; download /sync/snapshot again")
+    if format == "msgpack":
+        require_msgpack()
+        return Response(content=pack(changes), media_type="application/msgpack")
+    return changes
+
+@router.get("/sync/snapshot")
+async def get_snapshot(request: Request):
+    require_msgpack()
+    version, body = await snapshot_cache.get()
+    # Weak: rating stats may differ between builds of the same version.
+    headers = {"ETag": f'W/"catalog-{version}"', "X-Catalog-Version": str(version), "Cache-Control": "no-cache"}
+    if etag_matches(request, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/msgpack", headers=headers)
@@ -1,23 +1,28 @@
 from fastapi import APIRouter, HTTPException, Depends
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
 from models import User
 from database import user_collection
-from passlib.context import CryptContext
+from passwords import hash_password, verify_password
 from jose import JWTError, jwt
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
+from time import time
+from cache import TTLCache
 import os
 
 load_dotenv()
 
 router = APIRouter(prefix="/users", tags=["users"])
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="users/login")
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = "HS256"
 
+token_cache = TTLCache(maxsize=int(os.getenv("TOKEN_CACHE_SIZE", "10000")), ttl=float(os.getenv("TOKEN_CACHE_TTL", "300")))
+user_cache = TTLCache(maxsize=int(os.getenv("USER_CACHE_SIZE", "10000")), ttl=float(os.getenv("USER_CACHE_TTL", "60")))
+
 def user_serializer(user) -> dict:
     return {
         "id": str(user["_id"]),
@@ -28,38 +33,66 @@ def user_serializer(user) -> dict:
         "created_at": str(user.get("created_at")),
     }
 
+def decode_token(token: str) -> dict:
+    payload = token_cache.get(token)
+    if payload is None:
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        except JWTError:
+            raise HTTPException(status_code=401, detail="Invalid token")
+        if not payload.get("sub"):
+            raise HTTPException(status_code=401, detail="Invalid token")
+        ttl = token_cache.ttl
+        if payload.get("exp"):
+            # Never serve a cached token past its own expiry.
+            ttl = min(ttl, payload["exp"] - time())
+        token_cache.set(token, payload, ttl)
+    return payload
+
+async def get_current_identity(token: str = Depends(oauth2_scheme)):
+    return {"id": decode_token(token)["sub"]}
+
 async def get_current_user(token: str = Depends(oauth2_scheme)):
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id = payload.get("sub")
+    user_id = decode_token(token)["sub"]
+    serialized = user_cache.get(user_id)
+    if serialized is None:
         user = await user_collection.find_one({"_id": ObjectId(user_id)})
-        if user:
-            return user_serializer(user)
-    except JWTError:
-        raise HTTPException(status_code=401, detail="Invalid token")
-    raise HTTPException(status_code=404, detail="User not found")
+        if not user:
+            raise HTTPException(status_code=404, detail="User not found")
+        serialized = user_serializer(user)
+        user_cache.set(user_id, serialized)
+    return serialized
+
+def invalidate_user(user_id: str):
+    user_cache.pop(user_id)
 
 @router.post("/")
 async def create_user(user: User):
     if await user_collection.find_one({"email": user.email}):
         raise HTTPException(status_code=400, detail="Email already registered")
     new_user = user.dict()
-    new_user["password"] = pwd_context.hash(new_user["password"])
-    result = await user_collection.insert_one(new_user)
-    created_user = await user_collection.find_one({"_id": result.inserted_id})
-    return user_serializer(created_user)
+    new_user["password"] = await hash_password(new_user["password"])
+    try:
+        await user_collection.insert_one(new_user)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Email already registered")
+    return user_serializer(new_user)
 
 @router.get("/")
-async def get_users(user: dict = Depends(get_current_user)):
+async def get_users(user: dict = Depends(get_current_identity)):
     users = []
     async for u in user_collection.find():
         users.append(user_serializer(u))
     return users
 
+@router.get("/me")
+async def get_me(user: dict = Depends(get_current_user)):
+    return user
+
 @router.post("/login")
 async def login(form_data: OAuth2PasswordRequestForm = Depends()):
     user = await user_collection.find_one({"email": form_data.username})
-    if not user or not pwd_context.verify(form_data.password, user["password"]):
+    if not user or not await verify_password(form_data.password, user["password"]):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     token = jwt.encode({"sub": str(user["_id"]), "exp": datetime.utcnow() + timedelta(hours=1)}, SECRET_KEY, ALGORITHM)
     return {"access_token": token, "token_type": "bearer"}
\ No newline at end of file
@@ -0,0 +1,202 @@
+from bisect import bisect_left, insort
+from collections import Counter, defaultdict
+from heapq import nsmallest
+from time import monotonic
+from typing import Optional
+import asyncio
+import logging
+import os
+import re
+import unicodedata
+
+logger = logging.getLogger(__name__)
+
+# Other workers' writes only reach the index through a rebuild.
+SEARCH_INDEX_TTL_SECONDS = float(os.getenv("SEARCH_INDEX_TTL_SECONDS", "60"))
+FIELD_WEIGHTS = {
+    "name": 3.0,
+    "name_amharic": 3.0,
+    "ingredients": 2.0,
+    "region": 1.5,
+    "description": 1.0,
+}
+PREFIX_FACTOR = 0.8
+FUZZY_FACTOR = 0.6
+MIN_SIMILARITY = 0.4
+MIN_FUZZY_LENGTH = 3
+MAX_PREFIX_EXPANSIONS = 64
+
+# Ethiopic syllables come in rows of eight (consonant + seven vowel orders).
+# Homophone consonants are spelled interchangeably, so fold each row onto one.
+ETHIOPIC_START, ETHIOPIC_END = 0x1200, 0x137F
+ETHIOPIC_HOMOPHONES = {
+    0x1210: 0x1200,  # ሐ -> ሀ
+    0x1280: 0x1200,  # ኀ -> ሀ
+    0x1220: 0x1230,  # ሠ -> ሰ
+    0x12D0: 0x12A0,  # ዐ -> አ
+    0x1340: 0x1338,  # ፀ -> ጸ
+}
+# ሃ/ሀ and ኣ/አ (first and fourth order) are pronounced the same.
+ETHIOPIC_SAME_VOWEL_ROWS = (0x1200, 0x12A0)
+TOKEN_PATTERN = re.compile(r"\w+")
+
+def fold_ethiopic(char: str) -> str:
+    code = ord(char)
+    if not ETHIOPIC_START <= code <= ETHIOPIC_END:
+        return char
+    row, order = code & ~7, code & 7
+    row = ETHIOPIC_HOMOPHONES.get(row, row)
+    if row in ETHIOPIC_SAME_VOWEL_ROWS and order == 3:
+        order = 0
+    return chr(row + order)
+
+def normalize(text: str) -> str:
+    # Drop Latin accents and Ethiopic gemination marks, keep precomposed syllables.
+    decomposed = unicodedata.normalize("NFKD", text.casefold())
+    stripped = "".join(char for char in decomposed if unicodedata.category(char) != "Mn")
+    return "".join(fold_ethiopic(char) for char in unicodedata.normalize("NFC", stripped))
+
+def tokenize(text: str) -> list:
+    return TOKEN_PATTERN.findall(normalize(text)) if text else []
+
+def trigrams(token: str) -> set:
+    padded = f"\x02{token}\x03"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class SearchIndex:
+    def __init__(self, caches):
+        self.caches = {cache.name: cache for cache in caches}
+        self.items = {}
+        self.item_tokens = {}
+        self.postings = defaultdict(dict)
+        self.vocabulary = []
+        self.token_trigrams = defaultdict(set)
+        self.rebuild_task = None
+        self.built_at = 0.0
+        self.rebuilds = 0
+        for cache in caches:
+            cache.listeners.append(self.on_change)
+
+    def _add_token(self, token: str):
+        insort(self.vocabulary, token)
+        for trigram in trigrams(token):
+            self.token_trigrams[trigram].add(token)
+
+    def _remove_token(self, token: str):
+        del self.postings[token]
+        del self.vocabulary[bisect_left(self.vocabulary, token)]
+        for trigram in trigrams(token):
+            self.token_trigrams[trigram].discard(token)
+            if not self.token_trigrams[trigram]:
+                del self.token_trigrams[trigram]
+
+    def add(self, kind: str, item: dict):
+        key = (kind, item["id"])
+        self.remove(key)
+        weights = {}
+        for field, weight in FIELD_WEIGHTS.items():
+            value = item.get(field)
+            text = " ".join(value) if isinstance(value, list) else value
+            for token in tokenize(text):
+                weights[token] = max(weight, weights.get(token, 0))
+        for token, weight in weights.items():
+            if token not in self.postings:
+                self._add_token(token)
+            self.postings[token][key] = weight
+        self.items[key] = item
+        self.item_tokens[key] = tuple(weights)
+
+    def remove(self, key: tuple):
+        self.items.pop(key, None)
+        for token in self.item_tokens.pop(key, ()):
+            self.postings[token].pop(key, None)
+            if not self.postings[token]:
+                self._remove_token(token)
+
+    async def build(self):
+        # Build off to the side so searches keep working during a rebuild.
+        self.built_at = monotonic()
+        fresh = SearchIndex([])
+        for name, cache in self.caches.items():
+            if cache.ready:
+                for item in list(cache.items.values()):
+                    fresh.add(name, item)
+                continue
+            async for doc in cache.collection.find():
+                fresh.add(name, cache.serializer(doc))
+        self.items, self.item_tokens = fresh.items, fresh.item_tokens
+        self.postings, self.vocabulary, self.token_trigrams = fresh.postings, fresh.vocabulary, fresh.token_trigrams
+        self.rebuilds += 1
+
+    async def _rebuild(self):
+        try:
+            await self.build()
+        except Exception:
+            logger.exception("Search index rebuild failed")
+
+    def schedule_rebuild(self):
+        if self.rebuild_task is None or self.rebuild_task.done():
+            self.rebuild_task = asyncio.create_task(self._rebuild())
+
+    def on_change(self, cache, item_id: Optional[str], serialized: Optional[dict]):
+        if item_id is None:
+            self.schedule_rebuild()
+        elif serialized is None:
+            self.remove((cache.name, item_id))
+        else:
+            self.add(cache.name, serialized)
+
+    def _expand(self, query_token: str) -> dict:
+        # Best match factor per vocabulary token: exact, prefix, then fuzzy.
+        matches = {}
+        start = bisect_left(self.vocabulary, query_token)
+        for token in self.vocabulary[start:start + MAX_PREFIX_EXPANSIONS]:
+            if not token.startswith(query_token):
+                break
+            matches[token] = 1.0 if token == query_token else PREFIX_FACTOR
+        if len(query_token) < MIN_FUZZY_LENGTH:
+            return matches
+        query_trigrams = trigrams(query_token)
+        overlap = Counter()
+        for trigram in query_trigrams:
+            overlap.update(self.token_trigrams.get(trigram, ()))
+        for token, shared in overlap.items():
+            if token in matches or abs(len(token) - len(query_token)) > max(2, len(query_token) // 3):
+                continue
+            similarity = 2 * shared / (len(query_trigrams) + len(trigrams(token)))
+            if similarity >= MIN_SIMILARITY:
+                matches[token] = FUZZY_FACTOR * similarity
+        return matches
+
+    def search(self, query: str, kind: Optional[str] = None, limit: int = 20, offset: int = 0):
+        if monotonic() - self.built_at > SEARCH_INDEX_TTL_SECONDS:
+            # Answer from the current index; the rebuild runs in the background.
+            self.schedule_rebuild()
+        scores = None
+        for query_token in set(tokenize(query)):
+            best = {}
+            for token, factor in self._expand(query_token).items():
+                for key, weight in self.postings[token].items():
+                    if kind and key[0] != kind:
+                        continue
+                    best[key] = max(best.get(key, 0), weight * factor)
+            # Every query word has to match something.
+            if scores is None:
+                scores = best
+            else:
+                scores = {key: score + best[key] for key, score in scores.items() if key in best}
+            if not scores:
+                return 0, []
+        if not scores:
+            return 0, []
+        ranked = nsmallest(offset + limit, scores.items(), key=lambda entry: (-entry[1], self.items[entry[0]]["name"]))
+        return len(scores), [(self.items[key], round(score, 3)) for key, score in ranked[offset:]]
+
+    def stats(self) -> dict:
+        return {
+            "items": len(self.items),
+            "tokens": len(self.vocabulary),
+            "trigrams": len(self.token_trigrams),
+            "rebuilds": self.rebuilds,
+            "age_seconds": round(monotonic() - self.built_at, 1),
+        }
\ No newline at end of file
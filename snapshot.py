@@ -0,0 +1,198 @@
+from datetime import datetime, timedelta
+from time import monotonic
+from typing import Optional
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from database import counter_collection, change_collection
+from catalog import caches
+import asyncio
+import logging
+import mmap
+import os
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+logger = logging.getLogger(__name__)
+
+CATALOG_SNAPSHOT_PATH = os.getenv("CATALOG_SNAPSHOT_PATH", "")
+SNAPSHOT_TTL_SECONDS = float(os.getenv("CATALOG_SNAPSHOT_TTL_SECONDS", "300"))
+SYNC_PAGE_SIZE = 1000
+SNAPSHOT_FORMAT = 1
+COUNTER_ID = "catalog"
+# A version still unlogged after this long belongs to a writer that died.
+PENDING_TIMEOUT_SECONDS = 60
+# Ratings and list counters change without a catalog version bump.
+STATS_FIELDS = ("rating_count", "rating_avg", "rating_hist", "tried_count", "favorite_count")
+
+# The counters document holds "seq", the last version handed out, "reset", the
+# oldest version the change log can answer from (bumped by bulk imports), and
+# "pending", the versions handed out whose log entries aren't written yet.
+async def _bump(update):
+    try:
+        state = await counter_collection.find_one_and_update(
+            {"_id": COUNTER_ID}, update, upsert=True, return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        # Another worker created the counter first.
+        state = await counter_collection.find_one_and_update(
+            {"_id": COUNTER_ID}, update, return_document=ReturnDocument.AFTER
+        )
+    return state["seq"]
+
+def _next_seq() -> dict:
+    return {"$set": {"seq": {"$add": [{"$ifNull": ["$seq", 0]}, 1]}}}
+
+async def version_state() -> dict:
+    state = await counter_collection.find_one({"_id": COUNTER_ID}) or {}
+    seq = state.get("seq", 0)
+    cutoff = datetime.utcnow() - timedelta(seconds=PENDING_TIMEOUT_SECONDS)
+    pending = [entry["version"] for entry in state.get("pending", []) if entry["at"] >= cutoff]
+    # Every version up to "stable" is logged, so a cursor may safely advance to it.
+    return {"version": seq, "reset": state.get("reset", 0), "stable": min(pending) - 1 if pending else seq}
+
+async def record_change(kind: str, item_id: str, op: str):
+    # The version is marked pending in the same write that hands it out, and
+    # only cleared once its entry is logged, so /sync can't skip past it.
+    version = await _bump([
+        _next_seq(),
+        {"$set": {"pending": {"$concatArrays": [
+            {"$filter": {
+                "input": {"$ifNull": ["$pending", []]},
+                "cond": {"$gte": ["$$this.at", {"$subtract": ["$$NOW", PENDING_TIMEOUT_SECONDS * 1000]}]},
+            }},
+            [{"version": "$seq", "at": "$$NOW"}],
+        ]}}},
+    ])
+    try:
+        # One entry per item, so the log stays as small as the catalog.
+        await change_collection.update_one(
+            {"_id": f"{kind}:{item_id}", "version": {"$lt": version}},
+            {"$set": {"kind": kind, "item_id": item_id, "op": op, "version": version, "at": datetime.utcnow()}},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        # A newer change to the same item is already logged.
+        pass
+    finally:
+        await counter_collection.update_one({"_id": COUNTER_ID}, {"$pull": {"pending": {"version": version}}})
+
+async def record_reset():
+    # Bulk imports don't report which items they touched, so clients resync from a snapshot.
+    await _bump([_next_seq(), {"$set": {"reset": "$seq"}}])
+
+async def changes_since(since: int, limit: int = SYNC_PAGE_SIZE) -> Optional[dict]:
+    state = await version_state()
+    if since < state["reset"]:
+        return None
+    # Entries past "stable" may sit above a version that is still being logged.
+    query = {"version": {"$gt": since, "$lte": state["stable"]}}
+    entries = await change_collection.find(query).sort("version", 1).limit(limit + 1).to_list(None)
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+    upserted, deleted = {}, {}
+    for cache in caches:
+        ids = [entry["item_id"] for entry in entries if entry["kind"] == cache.name and entry["op"] == "upsert"]
+        found = await cache.get_many(ids) if ids else {}
+        upserted[cache.name] = [found[item_id] for item_id in ids if item_id in found]
+        # Gone since it was logged; its delete entry may not be written yet.
+        deleted[cache.name] = [item_id for item_id in ids if item_id not in found] + [
+            entry["item_id"] for entry in entries if entry["kind"] == cache.name and entry["op"] == "delete"
+        ]
+    return {
+        "version": entries[-1]["version"] if has_more else max(since, state["stable"]),
+        "has_more": has_more,
+        "upserted": upserted,
+        "deleted": deleted,
+    }
+
+async def build_snapshot() -> dict:
+    # Read the version first: anything written during the scan is re-sent by /sync.
+    snapshot = {
+        "format": SNAPSHOT_FORMAT,
+        "version": (await version_state())["version"],
+        "created_at": datetime.utcnow().isoformat(),
+    }
+    for cache in caches:
+        snapshot[cache.name] = [cache.serializer(doc) async for doc in cache.collection.find().sort("_id", 1)]
+    return snapshot
+
+def pack(value) -> bytes:
+    return msgpack.packb(value, use_bin_type=True)
+
+def write_snapshot_file(snapshot: dict, path: str):
+    temporary = f"{path}.tmp"
+    with open(temporary, "wb") as file:
+        file.write(pack(snapshot))
+    os.replace(temporary, path)
+
+def read_snapshot_file(path: str) -> dict:
+    with open(path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        return msgpack.unpackb(mapped, raw=False)
+
+async def warm_start() -> bool:
+    # Seeds the catalog caches from a snapshot file instead of a full collection scan.
+    path = CATALOG_SNAPSHOT_PATH
+    if not (path and msgpack and os.path.exists(path) and all(cache.enabled for cache in caches)):
+        return False
+    snapshot = read_snapshot_file(path)
+    if snapshot.get("format") != SNAPSHOT_FORMAT:
+        logger.warning("Ignoring snapshot %s with unknown format", path)
+        return False
+    pages, since = [], snapshot["version"]
+    while True:
+        page = await changes_since(since)
+        if page is None:
+            logger.warning("Snapshot %s predates the last catalog reset; loading from MongoDB", path)
+            return False
+        pages.append(page)
+        since = page["version"]
+        if not page["has_more"]:
+            break
+    for cache in caches:
+        items = {item["id"]: item for item in snapshot.get(cache.name, [])}
+        for page in pages:
+            items.update((item["id"], item) for item in page["upserted"][cache.name])
+            for item_id in page["deleted"][cache.name]:
+                items.pop(item_id, None)
+        # One narrow scan refreshes volatile stats and catches anything the log missed.
+        present, unknown = set(), []
+        async for doc in cache.collection.find({}, {field: 1 for field in STATS_FIELDS}):
+            item_id = str(doc["_id"])
+            present.add(item_id)
+            if item_id in items:
+                items[item_id].update((field, doc[field]) for field in STATS_FIELDS if field in doc)
+            else:
+                unknown.append(doc["_id"])
+        if unknown:
+            async for doc in cache.collection.find({"_id": {"$in": unknown}}):
+                items[str(doc["_id"])] = cache.serializer(doc)
+        cache.load_items(item for item_id, item in items.items() if item_id in present)
+    logger.info("Loaded catalog snapshot %s at version %s", path, snapshot["version"])
+    return True
+
+class SnapshotCache:
+    def __init__(self):
+        self.version = None
+        self.body = b""
+        self.built_at = 0.0
+        self.lock = asyncio.Lock()
+        self.builds = 0
+
+    async def get(self) -> tuple:
+        version = (await version_state())["version"]
+        if version != self.version or monotonic() - self.built_at > SNAPSHOT_TTL_SECONDS:
+            async with self.lock:
+                if version != self.version or monotonic() - self.built_at > SNAPSHOT_TTL_SECONDS:
+                    snapshot = await build_snapshot()
+                    self.body = await asyncio.to_thread(pack, snapshot)
+                    self.version, self.built_at = snapshot["version"], monotonic()
+                    self.builds += 1
+        return self.version, self.body
+
+    def stats(self) -> dict:
+        return {"version": self.version, "bytes": len(self.body), "builds": self.builds}
+
+snapshot_cache = SnapshotCache()